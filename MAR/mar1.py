@@ -1,6 +1,11 @@
 import cv2
 import numpy
 import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'..', 'src'))
+import frames
 
 # total is a rough metric for motion in a clip
 # sum of pixel values in differenced frames
@@ -22,19 +27,16 @@ if len(sys.argv)!=2:
     print "Usage : python mar1.py <video_file>"
     sys.exit(0)
 
-cap = cv2.VideoCapture(sys.argv[1])
+# frames are decoded and grayed ahead on a thread
+cap = frames.FrameSource(sys.argv[1], convert=cv2.COLOR_RGB2GRAY)
 
 # gobble the intro - 70 frames/2sec+change roughly covers either MAR version
 for x in xrange(1,70):
 	ret, frame1 = cap.read()
 
-ret, frame0 = cap.read()
-ret, frame1 = cap.read()
-ret, frame2 = cap.read()
-
-grayed0 = cv2.cvtColor(frame0, cv2.COLOR_RGB2GRAY)
-grayed1 = cv2.cvtColor(frame1, cv2.COLOR_RGB2GRAY)
-grayed2 = cv2.cvtColor(frame2, cv2.COLOR_RGB2GRAY)
+ret, grayed0 = cap.read()
+ret, grayed1 = cap.read()
+ret, grayed2 = cap.read()
 
 while(cap.isOpened()):
 
@@ -45,7 +47,7 @@ while(cap.isOpened()):
 	if ret == True:
 		grayed0 = grayed1
 		grayed1 = grayed2
-		grayed2 = cv2.cvtColor(next_frame, cv2.COLOR_RGB2GRAY)
+		grayed2 = next_frame
 
 		# hit q to quit
 		if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -0,0 +1,146 @@
+#!/usr/local/bin/python
+
+''' activity.py
+
+Find the active parts of a long recording with a cheap motion energy pre-pass.
+
+Each frame is grayed and shrunk, and its motion energy is the fraction of
+pixels that changed across the three frames around it: the same three-frame
+difference as detect.py, and MAR/mar1.py's total per frame. Frames become
+active when the energy goes over on_energy, and stay active until it has
+been below off_energy for hold frames. Active segments are padded either side
+and merged where they meet.
+
+Segments are (start, end) frame ranges, end exclusive, numbered as in the
+original video. They never include the first or last frame, which have no
+neighbours to difference with.
+
+arg1 = input video / image sequence
+*arg2* = optional outfile for the segments: START / END
+
+'''
+
+import sys
+import cv2
+import numpy as np
+import frames
+
+# frames are shrunk by this factor before differencing
+shrink = 4
+
+# grayscale difference that counts as a changed pixel
+change = 20
+
+# fraction of changed pixels that makes a frame active, and that keeps it so
+on_energy = 0.0003
+off_energy = 0.0001
+
+# frames a segment carries on for once the motion stops, and frames of
+# padding added either side of it
+hold = 15
+pad = 10
+
+
+# Motion energy of every frame of a clip. The first and last frames are 0.
+def energy(path):
+    source = frames.FrameSource(path, convert=cv2.COLOR_RGB2GRAY)
+    small = []
+    energies = []
+    count = 0
+
+    for frame in source:
+        count += 1
+        h, w = frame.shape[:2]
+        size = (max(w / shrink, 1), max(h / shrink, 1))
+        small.append(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+        if len(small) > 3:
+            small.pop(0)
+        if len(small) < 3:
+            continue
+
+        d1 = cv2.absdiff(small[2], small[1])
+        d2 = cv2.absdiff(small[1], small[0])
+        overlap = cv2.bitwise_and(d1, d2)
+        ret, thresh = cv2.threshold(overlap, change, 255, cv2.THRESH_BINARY)
+        energies.append(cv2.countNonZero(thresh) / float(thresh.size))
+
+    source.release()
+
+    result = np.zeros(count)
+    result[1:1 + len(energies)] = energies
+    return result
+
+
+# Active segments (start, end) from the motion energies of a clip's frames
+def segments(energies):
+    n = len(energies)
+    active = []
+    start = None
+    quiet = 0
+
+    for i, e in enumerate(energies):
+        if start is None:
+            if e > on_energy:
+                start = i
+                quiet = 0
+        else:
+            if e > off_energy:
+                quiet = 0
+            else:
+                quiet += 1
+
+            if quiet > hold:
+                active.append((start, i - quiet + 1))
+                start = None
+
+    if start is not None:
+        active.append((start, n))
+
+    # pad, keep clear of the first and last frames and merge any overlaps
+    padded = []
+    for start, end in active:
+        start = max(start - pad, 1)
+        end = min(end + pad, n - 1)
+        if end <= start:
+            continue
+
+        if len(padded) > 0 and start <= padded[-1][1]:
+            padded[-1] = (padded[-1][0], max(end, padded[-1][1]))
+        else:
+            padded.append((start, end))
+
+    return padded
+
+
+# Active segments of a video or image sequence
+def activeSegments(path):
+    return segments(energy(path))
+
+
+def main():
+    try:
+        path = sys.argv[1]
+    except IndexError:
+        print "Usage: ./activity.py <video> *<outfile>*"
+        sys.exit()
+
+    energies = energy(path)
+    active = segments(energies)
+
+    busy = sum(end - start for start, end in active)
+    print "> Frames:", len(energies)
+    print "> Active:", busy, "frames in", len(active), "segments"
+    for start, end in active:
+        print start, end
+
+    try:
+        outfile = open(sys.argv[2], 'w')
+        for start, end in active:
+            outfile.write(str(start) + ' ' + str(end) + '\n')
+        outfile.close()
+    except IndexError:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+#!/usr/local/bin/python
+
+''' benchmark.py
+- This measures the throughput of detection and tracking, so a change that
+  slows them down shows up before it goes in
+- It renders synthetic clips of a kicked ball, its flight from
+  generate_3d_data.py projected into a camera by project.project, at each of
+  the resolutions and clutter levels below. Clutter is a number of coloured
+  blobs wandering about the frame.
+- Times detect, kalman, trajectory selection and interpolation over each
+  clip (one camera's branch of pipeline.py), keeping the best of the repeats
+- Writes the times, frames per second, detection and trajectory counts and
+  how much of the ball's flight was found as JSON, and compares them with
+  the results of an earlier run if given
+
+The clips are rendered from a fixed seed into benchmark_clips next to the
+results, with their ground truth, and reused by later runs. Delete them to
+render them again.
+
+*arg1* = results outfile, otherwise benchmark.json
+*arg2* = results of an earlier run to compare against
+*arg3* = number of times to run each stage, otherwise 1
+'''
+
+import sys
+import os
+import math
+import time
+import json
+import platform
+import subprocess
+import multiprocessing
+import cv2
+import numpy as np
+import matplotlib.pyplot as plt
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(src)
+import detect
+import kalman
+import trajectories
+import interpolate
+import records
+import frames
+import project
+import generate_3d_data
+import structureTools as tools
+from compare_detectors import matched
+
+# clip sizes and numbers of distractors, a clip is rendered for each pair
+resolutions = [(640, 360), (1280, 720), (1920, 1080)]
+clutter = [0, 10, 40]
+
+seed = 0
+frame_rate = 30
+
+# frames of the clip before the kick and after the ball lands
+lead = 30
+tail = 30
+
+# the camera at 720p, scaled to the other resolutions: project.py's camera 1
+focal = 1000
+rt2on2 = math.sqrt(2) / 2
+rotation = np.mat([[rt2on2, 0, rt2on2],
+                   [0, 1, 0],
+                   [-rt2on2, 0, rt2on2]], dtype='float32')
+translation = (-5, 1, 14)
+
+# sizes at 720p: the ball's radius, and the range of the distractors' sizes
+ball_radius = 10
+min_blob = 10
+max_blob = 40
+
+# the stages timed, in the order they run
+stages = ['detect', 'kalman', 'select', 'interpolate']
+
+repeats = 1
+
+
+# The ball's flight in a clip of the given size as image points (x, y),
+# one a frame, y negative down from the top as detect.py gives them
+def flight(size):
+    s = size[1] / 720.0
+    K = tools.CalibArray(focal * s, size[0] / 2.0, -size[1] / 2.0)
+
+    X, Y, Z = generate_3d_data.trajectory(steps=int(
+        2.0 * generate_3d_data.v_y0 / generate_3d_data.g * frame_rate))
+    points = np.array(zip(X, Y, Z), dtype='float32')
+
+    project.verbose = False
+    return project.project(points, K, rotation, translation)[:, :, 0]
+
+
+# Render a clip of the ball kicked across a static background with
+# distractors blobs wandering about in front of it. Returns the ground truth
+# (x, y, frame) of the ball.
+def render(path, size, distractors):
+    w, h = size
+    s = h / 720.0
+    rand = np.random.RandomState(seed)
+
+    background = rand.randint(40, 100, (h, w, 3)).astype(np.uint8)
+    background = cv2.GaussianBlur(background, (7, 7), 0)
+
+    ball = flight(size)
+    radius = int(round(ball_radius * s))
+
+    position = rand.rand(distractors, 2) * (w, h)
+    velocity = rand.randn(distractors, 2) * 4 * s
+    axes = (rand.rand(distractors, 2) * (max_blob - min_blob) + min_blob) * \
+        s / 2
+    colours = rand.randint(100, 255, (distractors, 3)).tolist()
+
+    sink = frames.FrameSink(path, frame_rate)
+    truth = []
+    for i in xrange(lead + len(ball) + tail):
+        frame = background.copy()
+
+        for (x, y), (a, b), c in zip(position.tolist(),
+                                     axes.astype(int).tolist(), colours):
+            cv2.ellipse(frame, (int(x), int(y)), (a, b), 0, 0, 360, c, -1)
+        position = (position + velocity) % (w, h)
+
+        if lead <= i < lead + len(ball):
+            x, y = ball[i - lead]
+            cv2.circle(frame, (int(round(x)), int(round(-y))), radius,
+                       (250, 250, 250), -1)
+            truth.append((x, y, i))
+
+        sink.write(frame)
+
+    sink.release()
+    return records.pack(truth, records.POINT)
+
+
+# The clip for a size and clutter level and its ground truth, rendering them
+# unless they're already in clip_dir
+def clip(clip_dir, size, distractors):
+    name = 'ball_%dx%d_%d' % (size[0], size[1], distractors)
+    path = os.path.join(clip_dir, name + '.avi')
+    truth_file = os.path.join(clip_dir, name + '_truth.npy')
+
+    if not os.path.exists(path) or not os.path.exists(truth_file):
+        print "> Rendering", name
+        records.save(truth_file, render(path, size, distractors))
+
+    return name, path, records.load(truth_file, records.POINT)
+
+
+# Best wall clock time of repeats calls of a stage, and its result
+def timed(stage, *args):
+    best = None
+    for i in xrange(repeats):
+        start = time.time()
+        result = stage(*args)
+        secs = time.time() - start
+        if best is None or secs < best:
+            best = secs
+
+    return best, result
+
+
+def detectStage(path):
+    return records.pack(detect.detectClip(path), records.DETECTION)
+
+
+def kalmanStage(detections):
+    return records.pack(kalman.segment(detections), records.TRAJECTORY)
+
+
+def selectStage(candidates, detections):
+    trajectory, fig = trajectories.select(candidates, detections)
+    plt.close(fig)
+    return trajectory
+
+
+def interpolateStage(trajectory):
+    interpolate.view = False
+    return interpolate.interpolateTrajectory(trajectory, frame_rate)
+
+
+# Time each stage over a clip, each fed the output of the one before.
+# Stages left with nothing to work on aren't timed.
+def run(path, truth):
+    n = detect.frameCount(path)
+    result = {'frames': n, 'stages': {}}
+
+    def record(stage, secs):
+        result['stages'][stage] = {'secs': secs,
+                                   'fps': n / secs if secs > 0 else None}
+
+    secs, detections = timed(detectStage, path)
+    record('detect', secs)
+    result['detections'] = len(detections)
+    result['recall'] = None
+    if len(truth) > 0 and len(detections) > 0:
+        result['recall'] = float(matched(truth, detections).mean())
+
+    result['trajectories'] = 0
+    result['tracked'] = None
+    if len(detections) > 0:
+        secs, candidates = timed(kalmanStage, detections)
+        record('kalman', secs)
+        if len(candidates) > 0:
+            result['trajectories'] = len(np.unique(candidates['tid']))
+
+            secs, trajectory = timed(selectStage, candidates, detections)
+            record('select', secs)
+            if len(truth) > 0 and len(trajectory) > 0:
+                result['tracked'] = float(matched(truth, trajectory).mean())
+
+            if len(trajectory) > 1:
+                secs, points = timed(interpolateStage, trajectory)
+                record('interpolate', secs)
+
+    total = sum(s['secs'] for s in result['stages'].values())
+    result['stages']['pipeline'] = {'secs': total,
+                                    'fps': n / total if total > 0 else None}
+
+    return result
+
+
+# The commit the source is at, if it's in a git checkout
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=src,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fps(result, stage):
+    value = result['stages'].get(stage, {}).get('fps')
+    return '-' if value is None else '%.1f' % value
+
+
+def share(value):
+    return '-' if value is None else '%.3f' % value
+
+
+# Print the frames per second of each stage against an earlier run's
+def compare(results, earlier):
+    print
+    print "Against", earlier['commit'], "from", earlier['date']
+    print "%-22s %-12s %10s %10s %8s" % ('clip', 'stage', 'before',
+                                         'after', 'change')
+
+    before = dict((r['clip'], r) for r in earlier['clips'])
+    for result in results['clips']:
+        old = before.get(result['clip'])
+        if old is None:
+            continue
+
+        for stage in stages + ['pipeline']:
+            a = old['stages'].get(stage, {}).get('fps')
+            b = result['stages'].get(stage, {}).get('fps')
+            change = '-'
+            if a and b:
+                change = '%+.1f%%' % (100.0 * (b - a) / a)
+
+            print "%-22s %-12s %10s %10s %8s" % \
+                (result['clip'], stage, fps(old, stage), fps(result, stage),
+                 change)
+
+
+def main():
+    global repeats
+
+    try:
+        outfile = sys.argv[1]
+    except IndexError:
+        outfile = 'benchmark.json'
+
+    try:
+        earlier = json.load(open(sys.argv[2]))
+    except IndexError:
+        earlier = None
+
+    try:
+        repeats = int(sys.argv[3])
+    except IndexError:
+        pass
+
+    clip_dir = os.path.join(os.path.dirname(os.path.abspath(outfile)),
+                            'benchmark_clips')
+    if not os.path.isdir(clip_dir):
+        os.makedirs(clip_dir)
+
+    plt.switch_backend('Agg')
+
+    results = {'commit': commit(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python': platform.python_version(),
+               'opencv': cv2.__version__,
+               'numpy': np.__version__,
+               'cpus': multiprocessing.cpu_count(),
+               'repeats': repeats,
+               'clips': []}
+
+    for size in resolutions:
+        for distractors in clutter:
+            name, path, truth = clip(clip_dir, size, distractors)
+            print "> Benchmarking", name
+
+            result = run(path, truth)
+            result.update({'clip': name, 'width': size[0],
+                           'height': size[1], 'clutter': distractors})
+            results['clips'].append(result)
+
+    with open(outfile, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    print
+    print "%-22s %7s %10s %10s %10s %11s %7s %8s" % \
+        ('clip', 'frames', 'detect', 'kalman', 'pipeline', 'detections',
+         'recall', 'tracked')
+    for r in results['clips']:
+        print "%-22s %7d %10s %10s %10s %11d %7s %8s" % \
+            (r['clip'], r['frames'], fps(r, 'detect'), fps(r, 'kalman'),
+             fps(r, 'pipeline'), r['detections'], share(r['recall']),
+             share(r['tracked']))
+    print "(frames per second)"
+    print "> written to:", outfile
+
+    if earlier is not None:
+        compare(results, earlier)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/local/bin/python
+
+''' check_parallel.py
+- This checks that detecting in parallel chunks gives exactly the same
+  detections as a serial run, on a real encoded clip
+- Frame numbers only come out right if every chunk starts reading from the
+  frame it asked for, which inter-coded video doesn't always make easy (see
+  trust_seek in frames.py), so it's worth running on footage from each new
+  camera or codec
+- Small chunks put lots of chunk boundaries into the clip. Exits non-zero if
+  any detection differs.
+
+arg1 = input video / image sequence
+*arg2* = number of worker processes, otherwise 2
+*arg3* = frames a chunk, otherwise 7
+'''
+
+import sys
+import os.path
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..'))
+import detect
+
+
+def main():
+    try:
+        path = sys.argv[1]
+    except IndexError:
+        print "Usage: ./check_parallel.py <video> *<workers>* *<chunk>*"
+        sys.exit()
+
+    try:
+        workers = int(sys.argv[2])
+    except IndexError:
+        workers = 2
+
+    try:
+        chunk = int(sys.argv[3])
+    except IndexError:
+        chunk = 7
+
+    start = time.time()
+    serial = detect.detectClip(path, skip_idle=False)
+    print "> Serial:", len(serial), "detections in %.1fs" % \
+        (time.time() - start)
+
+    start = time.time()
+    parallel = detect.detectParallel(path, workers, chunk, skip_idle=False)
+    print "> Parallel:", len(parallel), "detections in %.1fs" % \
+        (time.time() - start), "(" + str(workers), "workers,", chunk, \
+        "frame chunks)"
+
+    differ = [(a, b) for a, b in zip(serial, parallel) if a != b]
+    if len(serial) != len(parallel) or len(differ) > 0:
+        print "FAIL: the detections differ"
+        for a, b in differ[:10]:
+            print "  serial", a, "parallel", b
+        sys.exit(1)
+
+    print "> OK: the detections are the same"
+
+
+if __name__ == '__main__':
+    main()
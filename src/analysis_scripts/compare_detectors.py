@@ -0,0 +1,94 @@
+#!/usr/local/bin/python
+
+''' compare_detectors.py
+- This is a utility for choosing the detector backend to use at a venue
+- It runs each of detect.py's detector backends over the same clip, timing it
+- Compares the detections to ground truth coordinates if given, and prints
+  the throughput and recall of each backend side by side
+
+arg1 = input video / image sequence
+*arg2* = ground truth file: x / y / frame, as clicked in detect.py
+*arg3* = comma separated backends to compare, otherwise all of them
+'''
+
+import sys
+import os.path
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..'))
+import detect
+import records
+
+# detections within this many pixels of a truth count as finding it
+max_sep = 25
+
+
+# Which of the points a have a point in b in the same frame within max_sep
+def matched(a, b):
+    found = np.zeros(len(a), bool)
+
+    for frame in np.unique(a['frame']):
+        here = a['frame'] == frame
+        there = b[b['frame'] == frame]
+        if len(there) == 0:
+            continue
+
+        dx = a['x'][here][:, None] - there['x'][None, :]
+        dy = a['y'][here][:, None] - there['y'][None, :]
+        found[here] = (np.hypot(dx, dy) < max_sep).any(axis=1)
+
+    return found
+
+
+def main():
+    try:
+        path = sys.argv[1]
+    except IndexError:
+        print "Usage: ./compare_detectors.py <video> *<ground_truth>*" + \
+            " *<backends>*"
+        sys.exit()
+
+    try:
+        truth = records.load(sys.argv[2], records.POINT)
+    except IndexError:
+        truth = None
+
+    try:
+        backends = sys.argv[3].split(',')
+    except IndexError:
+        backends = sorted(detect.detectors)
+
+    frames = detect.frameCount(path)
+    print "Clip:", path, "(" + str(frames), "frames)"
+    if truth is not None:
+        print "Truths:", len(truth)
+
+    print
+    print "%-10s %8s %8s %12s %8s %10s" % \
+        ('backend', 'secs', 'fps', 'detections', 'recall', 'precision')
+
+    for backend in backends:
+        start = time.time()
+        detections = detect.detectClip(path, detector=backend)
+        secs = time.time() - start
+
+        detections = records.pack(detections, records.DETECTION)
+        fps = frames / secs if frames > 0 else 0
+
+        recall = precision = '-'
+        if truth is not None and len(truth) > 0:
+            recall = '%.3f' % matched(truth, detections).mean()
+
+            # only frames with a truth in can say whether a detection's right
+            judged = detections[np.in1d(detections['frame'], truth['frame'])]
+            if len(judged) > 0:
+                precision = '%.3f' % matched(judged, truth).mean()
+
+        print "%-10s %8.2f %8.1f %12d %8s %10s" % \
+            (backend, secs, fps, len(detections), recall, precision)
+
+
+if __name__ == '__main__':
+    main()
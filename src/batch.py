@@ -0,0 +1,194 @@
+#!/usr/local/bin/python
+
+''' batch.py
+
+Headless batch analysis of whole sessions of free kicks.
+
+Finds every clip under a directory of videos laid out as
+
+    <videos>/<session>/<clip>/video1.*  (video file or image sequence folder)
+    <videos>/<session>/<clip>/video2.*
+
+queues them, and runs the pipeline (pipeline.py) for each one on a pool of
+worker processes, printing each clip's progress and timings. The scene data
+of a session (calibration, goalposts, static matches) has to exist in
+sessions/<session> already, it's created once with squawkFly.py.
+
+Each clip's stage timings and memory use are written to its
+stats/profile.json, profiling.py adds them up for the whole session.
+
+An interrupted batch can just be run again: stages whose outputs in
+sessions/<session>/<clip> were made from the same inputs and parameters are
+skipped (see the stage cache in pipeline.py).
+
+arg1 = directory of session/clip videos
+*arg2* = number of worker processes, otherwise one per core
+*arg3* = 'restart' to ignore existing outputs and run every stage again
+
+'''
+
+import sys
+import os
+import glob
+import time
+import multiprocessing
+import matplotlib.pyplot as plt
+import pipeline
+import profiling
+
+# seconds to wait for a clip before checking again, waiting with a timeout
+# lets Ctrl-C through to the pool
+poll = 1.0
+
+
+# The video file or image sequence for camera n in a clip folder
+def findVideo(clip_dir, n):
+    found = glob.glob(os.path.join(clip_dir, 'video' + str(n) + '*'))
+    if len(found) == 1:
+        return found[0]
+    return None
+
+
+# Every clip under root with both videos: (session, clip, video1, video2)
+def discover(root):
+    clips = []
+    for session in sorted(os.listdir(root)):
+        session_dir = os.path.join(root, session)
+        if not os.path.isdir(session_dir):
+            continue
+
+        # a session's clips can only be reconstructed with its scene data
+        p_session = pipeline.sessionPath(session)
+        missing = [f for f in pipeline.requiredSceneFiles(session)
+                   if not os.path.exists(os.path.join(p_session, f))]
+        if len(missing) != 0:
+            print "WARN: Skipping session", session, "with no", \
+                ', '.join(missing)
+            continue
+
+        # kicks.py writes a clip to <clip>.part until it's complete
+        for clip in sorted(os.listdir(session_dir)):
+            clip_dir = os.path.join(session_dir, clip)
+            if clip.endswith('.part') or not os.path.isdir(clip_dir):
+                continue
+
+            vid1 = findVideo(clip_dir, 1)
+            vid2 = findVideo(clip_dir, 2)
+            if vid1 is None or vid2 is None:
+                print "WARN: Skipping clip", clip_dir, \
+                    "without a video1 and video2"
+                continue
+
+            clips.append((session, clip, vid1, vid2))
+
+    return clips
+
+
+# Pool worker: analyse a clip and save its views.
+# Returns (session/clip, seconds taken, error or None)
+def clipJob(job):
+    session, clip, vid1, vid2, cache = job
+    name = session + '/' + clip
+    start = time.time()
+
+    def status(message):
+        print "[%s %.1fs] %s" % (name, time.time() - start, message)
+        sys.stdout.flush()
+
+    plt.switch_backend('Agg')
+    profile = profiling.Profile()
+    try:
+        pipeline.analyse(session, clip, vid1, vid2, parallel=False,
+                         cache=cache, status=status, profile=profile)
+        pipeline.saveViews(session, clip, cache, status, profile)
+        profile.save(pipeline.clipPath(session, clip))
+    except Exception as e:
+        return name, time.time() - start, repr(e)
+
+    return name, time.time() - start, None
+
+
+# Analyse the clips (session, clip, video1, video2) on a pool of workers,
+# then draw each session's goalmouth view. Returns the clips that failed.
+def run(clips, workers, cache=True):
+    plt.switch_backend('Agg')
+    start = time.time()
+    failed = []
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.imap_unordered(clipJob,
+                                      [c + (cache,) for c in clips])
+        for i in xrange(len(clips)):
+            while True:
+                try:
+                    name, seconds, error = results.next(poll)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+            if error is None:
+                print "> [%d/%d] %s done in %.1fs" % \
+                    (i + 1, len(clips), name, seconds)
+            else:
+                failed.append(name)
+                print "> [%d/%d] %s FAILED after %.1fs: %s" % \
+                    (i + 1, len(clips), name, seconds, error)
+    except KeyboardInterrupt:
+        print "> Interrupted, run again to resume"
+        pool.terminate()
+        pool.join()
+        sys.exit(1)
+    except Exception:
+        pool.terminate()
+        pool.join()
+        raise
+
+    pool.close()
+    pool.join()
+
+    # the goalmouth view covers every clip in a session
+    for session in sorted(set(c[0] for c in clips)):
+        p_session = pipeline.sessionPath(session)
+        try:
+            pipeline.runScript('beehive.py', p_session,
+                               os.path.join(p_session, 'beehive.png'))
+        except Exception as e:
+            print "WARN: No goalmouth view for", session + ":", repr(e)
+
+    print "> Finished", len(clips) - len(failed), "of", len(clips), \
+        "clips in %.1fs" % (time.time() - start)
+    if len(failed) != 0:
+        print "> Failed:", ' '.join(failed)
+
+    return failed
+
+
+def main():
+    if len(sys.argv) < 2:
+        print "Usage : ./batch.py <videos> *<workers>* *<restart>*"
+        sys.exit(0)
+
+    root = sys.argv[1]
+
+    try:
+        workers = int(sys.argv[2])
+    except IndexError:
+        workers = multiprocessing.cpu_count()
+
+    cache = True
+    try:
+        if sys.argv[3] == 'restart':
+            cache = False
+    except IndexError:
+        pass
+
+    clips = discover(root)
+    print "> Queued", len(clips), "clips on", workers, "workers"
+    if len(clips) == 0:
+        return
+
+    run(clips, workers, cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,7 @@ import sys
 import os
 import matplotlib.pyplot as plt
 import matplotlib.image as image
+import records
 
 # get the relevant session
 session = sys.argv[1]
@@ -28,20 +29,13 @@ shots_y = []
 
 for sub in clips:
     # get the 3D trajectory data for each clip
-    t_path = os.path.join(session, sub, '3d_out.txt')
-    with open(t_path) as t_file:
-        trajectory = t_file.read()
-        t_file.close()
-    trajectory = trajectory.split('\n')
-
-    # remove blank line if it's there
-    if trajectory[-1] in ['\n', '\r\n', '']:
-        trajectory.pop(-1)
+    t_path = records.path(os.path.join(session, sub, '3d_out'))
+    trajectory = records.load(t_path, records.POINT3D)
 
     # get the last point + project into X-Y plane
     final = trajectory[-1]
-    x = float(final.split()[0])
-    y = float(final.split()[1])
+    x = float(final['x'])
+    y = float(final['y'])
     shots_x.append(x)
     shots_y.append(y)
 
@@ -32,6 +32,7 @@ import cv2.cv as cv
 import numpy as np
 import glob
 import os
+import frames
 
 # Default to showing the calibration images unless told otherwise
 view = True
@@ -68,11 +69,13 @@ elif os.path.isfile(source):
 
     is_video = True
     print "Calibrate from video:", source
-    cap = cv2.VideoCapture(source)
+    cap = frames.FrameSource(source)
     count = 0
 
     while(cap.isOpened()):
         ret, img = cap.read()
+        if not ret:
+            break
         count += 1
         # take every 30th frame (roughly a second at 30FPS)
         if count % 30 == 0:
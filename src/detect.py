@@ -9,116 +9,1138 @@ Output: Cloud of image point detections with frame data and unique point_ID
 
 arg1 = input video / image sequence
 *arg2* = outfile path, otherwise just to data/detections.txt
+         (a .npy outfile is written in the binary format of records.py)
 *arg3* = 'suppress' to suppress any graphical feedback
+*arg4* = number of worker processes, to detect in parallel across chunks
+*arg5* = optional video outfile of the annotated frames, for debugging
+
+Importing this module has no side effects. DetectionEngine holds all of the
+per-clip state, so a long-lived process can instantiate one per clip, feed it
+frames and collect the detections in memory:
+
+    engine = detect.DetectionEngine()
+    for frame in frames:
+        engine.feed(frame)
+    engine.detections
+
+detectParallel splits a clip into overlapping chunks of frames and runs an
+engine per chunk in a process pool. Frame numbers and point IDs come out the
+same as a serial run.
+
+Engines can be restricted to a region of interest (roi=), can search
+coarse-to-fine on downscaled frames (scale=) and can track the ball online to
+only search around its predicted position (track=), see DetectionEngine.
+
+The foreground is found by a pluggable detector backend (detector=, see
+detectors): three-frame differencing by default, or a running average or
+mixture of gaussians background model. Background models learn as they go, so
+in detectParallel each chunk's model starts afresh.
+
+The size filter's bounds are scaled to the resolution of the clip. With auto
+on, the detection threshold and minimum size are also tuned to each clip from
+a warm-up sample of its first frames (see tune).
+
+With skip_idle on, a motion energy pre-pass (activity.py) finds the active
+segments of a long recording and only they are searched, keeping the frame
+numbers of the whole recording.
+
+Ball positions are the centroids of the detected blobs, from their moments
+(centroid=, see DetectionEngine), to sub-pixel accuracy.
+
+Unless annotate is on, an engine never draws anything and only holds on to the
+latest colour frame. detectClip can write the annotated frames to a video
+(annotated=) when the debugging output is wanted.
 
 '''
 
 import sys
 import cv2
+import cv2.cv as cv
 import numpy as np
 import os.path
+import glob
+import math
+import multiprocessing
+import kalman
+import records
+import frames
+import activity
 sys.path.append('/usr/local/lib/python2.7/site-packages')
 
+# Size (area) filter bounds at 720p, scaled to the frame height of a clip
+max_area = 1500
+min_area = 250
+reference_height = 720
 
-# Mouse call-back
-# In case we want to generate ground truth detections by-eye
-def click(event, x, y, flags, param):
-    if event == cv2.EVENT_LBUTTONDOWN:
-        # make sure to invert y-coord
-        string = str(x) + ' -' + str(y) + ' ' + str(time)
-        truthfile.write(string + '\n')
+# Auto-tuning: the first warmup frames of a clip set the detection threshold,
+# and min_area is raised until there are no more than max_blobs detections a
+# frame for the tracking to get through
+auto = False
+warmup = 30
+max_blobs = 8
+
+# Only search the active segments of a clip, see activity.py
+skip_idle = False
+
+# Detector backend, one of detectors
+detector = 'diff'
+
+# Where a blob's position is taken: 'box' centre, 'moments' centroid or
+# 'intensity' weighted centroid
+centroid = 'moments'
 
 # Flags: Debug mode, tracking display, pause
 showDiff = False
 tracking = True
 paused = False
 
-# Size (area) filter bounds
-max_area = 1500
-min_area = 250
-
-# Initialise variables
-startOfFile = True
-time = 0
+# Command line state
 cap = 0
-point_index = 0
-outfile = None
+sink = None
 truthfile = None
 
-# Detection list
-detections = []
 
-# Default to showing the detection streams, suppress if told to
-view = True
-try:
-    if sys.argv[3] == 'suppress':
-        view = False
-except IndexError:
-    pass
+# The value given, or the module setting of that name if it's None. Read when
+# called, so the settings can be changed after importing the module.
+def setting(name, value):
+    if value is None:
+        return globals()[name]
+    return value
+
+
+# Mouse call-back
+# In case we want to generate ground truth detections by-eye
+def click(event, x, y, flags, engine):
+    if event == cv2.EVENT_LBUTTONDOWN:
+        # make sure to invert y-coord
+        string = str(x) + ' -' + str(y) + ' ' + str(engine.time)
+        truthfile.write(string + '\n')
+
+
+# Holds everything needed to run detection over a single clip. Frames are fed
+# in one at a time, and each feed returns the detections found in the middle
+# frame of the latest three.
+#
+# roi restricts detection to part of the frame. It can be a rectangle
+# (x, y, w, h), a binary mask image the size of the frame, or the filename of
+# one. Only the bounding rectangle of a mask is processed at all.
+#
+# scale > 1 runs coarse-to-fine: diff/morph/search run on frames downscaled by
+# that factor, and only small windows around the coarse candidates are
+# processed again at full resolution to make the detections.
+#
+# track=True tracks the ball online while detecting, see Tracker. While a
+# track is confirmed only the gate around its predicted position is searched.
+#
+# detector picks the backend that finds the foreground: a name in detectors,
+# or a class to make one with, the detector setting by default. thresh is
+# its threshold if not the backend's default.
+#
+# The size bounds default to min_area and max_area scaled to the frames.
+#
+# centroid is where each blob's position is taken. 'box' is the centre of its
+# bounding box, as it used to be, which is only good to half a pixel.
+# 'moments' is the centroid of the blob's outline from its moments.
+# 'intensity' goes on to refine that with the brightness of the middle frame
+# inside the blob, weighting the ball over the background the morph ops
+# grew the blob into. The centroid setting by default.
+class DetectionEngine(object):
+
+    def __init__(self, max_area=None, min_area=None,
+                 annotate=False, start=0, roi=None, scale=1, track=False,
+                 detector=None, centroid=None, thresh=None):
+        self.max_area = max_area
+        self.min_area = min_area
+
+        detector = setting('detector', detector)
+        self.backend = detectors.get(detector, detector)
+        self.backendArgs = {}
+        if thresh is not None:
+            self.backendArgs['thresh'] = thresh
+        self.detector = self.backend(**self.backendArgs)
+        self.coarseDetector = None
+        self.centroid = setting('centroid', centroid)
+
+        # draw contours, areas and boxes onto the source frames. Headless,
+        # the colour frames aren't needed once they're grayed
+        self.annotate = annotate
+        self.depth = 3 if annotate else 1
+
+        # time is the frame number of the frame currently being searched,
+        # start is the frame number of the first frame fed in
+        self.time = start
+        self.point_index = 0
+        self.detections = []
+
+        # the last three frames (just the latest one if headless), and the
+        # latest thresholded image
+        self.frames = []
+        self.thresh = None
+
+        # region of interest and coarse-to-fine factor
+        self.roi = roi
+        self.mask = None
+        self.scale = int(scale)
+
+        # online tracker to gate the search with
+        self.tracker = None
+        if track:
+            self.tracker = Tracker()
+
+        # ring of grayscale frames plus a buffer for every step of diff and
+        # morph, allocated once the frame size is known
+        self.fed = 0
+        self.grayed = None
+        self.small = None
+        self.buffers = None
+        self.coarse = None
+
+        # foreground of the middle frame for the whole roi, for backends
+        # that can't be run on windows
+        self.foreground = None
+        self.coarseForeground = None
+
+    # preallocate every image the per-frame processing needs
+    def allocate(self, frame):
+        low, high = scaledAreas(frame.shape[0])
+        if self.min_area is None:
+            self.min_area = low
+        if self.max_area is None:
+            self.max_area = high
+
+        # the tracker's confirming speed is at 720p like the areas
+        if self.tracker is not None:
+            self.tracker.speed *= float(frame.shape[0]) / reference_height
+
+        # the morph ops grow blobs by the same fraction of the frame too
+        self.kernel = scaledKernel(self.detector.kernel, frame.shape[0])
+
+        self.rect, self.mask = regionOfInterest(self.roi, frame.shape[:2])
+        x, y, w, h = self.rect
+        shape = (h, w)
+
+        self.grayed = [np.empty(shape, np.uint8) for i in range(3)]
+        self.buffers = dict((name, np.empty(shape, np.uint8)) for name in
+                            ('d1', 'd2', 'overlap', 'temp', 'thresh',
+                             'contours'))
+
+        if self.scale > 1:
+            shape = (max(h / self.scale, 1), max(w / self.scale, 1))
+            self.small = [np.empty(shape, np.uint8) for i in range(3)]
+            self.coarse = dict((name, np.empty(shape, np.uint8)) for name in
+                               ('d1', 'd2', 'overlap', 'temp', 'thresh',
+                                'contours'))
+
+            # keep the morphological ops the same physical size
+            k = self.kernel
+            size = max(k.shape[0] / self.scale, 1) | 1
+            self.coarse['kernel'] = np.ones((size, size), np.uint8)
+
+            if self.mask is not None:
+                self.coarse['mask'] = cv2.resize(
+                    self.mask, (shape[1], shape[0]),
+                    interpolation=cv2.INTER_NEAREST)
+
+            # the downscaled frames need a model of their own
+            self.coarseDetector = self.backend(**self.backendArgs)
+
+    # the oldest frame is finished with once the next one is fed, so a
+    # reader can decode straight into it afterwards:
+    # spare = engine.spare(); engine.feed(frame); source.recycle(spare)
+    def spare(self):
+        if len(self.frames) == self.depth:
+            return self.frames[0]
+        return None
+
+    # add the next frame and search the middle one of the latest three
+    def feed(self, frame, search=True):
+        if self.buffers is None:
+            self.allocate(frame)
+        x, y, w, h = self.rect
+
+        # rotate the ring so the oldest grayscale buffer takes the new frame
+        self.grayed.append(self.grayed.pop(0))
+        cv2.cvtColor(frame[y:y + h, x:x + w], cv2.COLOR_RGB2GRAY,
+                     self.grayed[2])
+
+        if self.scale > 1:
+            self.small.append(self.small.pop(0))
+            size = (self.small[2].shape[1], self.small[2].shape[0])
+            cv2.resize(self.grayed[2], size, self.small[2],
+                       interpolation=cv2.INTER_AREA)
+
+        self.frames.append(frame)
+        if len(self.frames) > self.depth:
+            self.frames.pop(0)
+
+        self.fed += 1
+        if self.fed < 3:
+            return []
+        self.time += 1
+
+        # background models learn from every frame, searched or not, so
+        # their foreground is always found over the whole roi
+        if not self.detector.windowed:
+            self.foreground = foreground(self.detector, self.grayed,
+                                         self.buffers, self.mask)
+            if self.scale > 1:
+                c = self.coarse
+                self.coarseForeground = foreground(self.coarseDetector,
+                                                   self.small, c,
+                                                   c.get('mask'))
+
+        # a confirmed track only needs the gate around its prediction
+        gate = None
+        if self.tracker is not None:
+            gate = self.tracker.predict()
+
+        if gate is not None:
+            found = self.searchGate(gate, search)
+        elif self.scale > 1:
+            found = self.coarseToFine(search)
+        else:
+            found = self.searchFrame(search)
+
+        if self.tracker is not None:
+            self.tracker.update(found)
+
+        return found
+
+    # diff, morph and search the whole region of interest
+    def searchFrame(self, search):
+        x, y, w, h = self.rect
+
+        # foreground and morphological ops
+        b = self.buffers
+        if self.detector.windowed:
+            self.thresh = threshold(self.grayed, b, self.mask,
+                                    self.kernel, self.detector)
+        else:
+            self.thresh = morph(self.foreground, b['thresh'], b['temp'],
+                                self.kernel)
+
+        # findContours modifies its input so search a copy
+        if search:
+            b = self.buffers
+            np.copyto(b['contours'], self.thresh)
+            return self.search(b['contours'], x, y,
+                               self.canvas(x, y, x + w, y + h),
+                               self.brightness(0, 0, w, h))
+
+        return []
+
+    # the part of the middle frame to draw on when annotating, otherwise None
+    def canvas(self, x1, y1, x2, y2):
+        if not self.annotate:
+            return None
+        return self.frames[1][y1:y2, x1:x2]
+
+    # the window [x1, y1, x2, y2] of the roi in the grayscale middle frame
+    # for intensity weighted centroids, otherwise None
+    def brightness(self, x1, y1, x2, y2):
+        if self.centroid != 'intensity':
+            return None
+        return self.grayed[1][y1:y2, x1:x2]
+
+    # search the window around a predicted position (x, y, radius), which
+    # is padded so the morph ops see the whole of any blob inside it
+    def searchGate(self, gate, search):
+        if not search:
+            return []
+
+        x0, y0, w, h = self.rect
+        half = int(gate[2]) + 2 * self.kernel.shape[0] + \
+            int(self.max_area ** 0.5)
+        cx = int(gate[0]) - x0
+        cy = int(-gate[1]) - y0
+
+        x1, y1 = max(cx - half, 0), max(cy - half, 0)
+        x2, y2 = min(cx + half, w), min(cy + half, h)
+
+        # predicted off the edge of the frame
+        if x2 <= x1 or y2 <= y1:
+            return []
+
+        return self.searchWindow(x1, y1, x2, y2)
+
+    # diff, morph and search a window [x1, y1, x2, y2] of the roi at full
+    # resolution
+    def searchWindow(self, x1, y1, x2, y2):
+        x0, y0 = self.rect[:2]
+
+        if self.detector.windowed:
+            grayed = [g[y1:y2, x1:x2] for g in self.grayed]
+
+            mask = None
+            if self.mask is not None:
+                mask = self.mask[y1:y2, x1:x2]
+
+            thresh = threshold(grayed, {}, mask, self.kernel, self.detector)
+        else:
+            thresh = morph(self.foreground[y1:y2, x1:x2], k=self.kernel)
+
+        src = self.canvas(x0 + x1, y0 + y1, x0 + x2, y0 + y2)
+        return self.search(thresh, x0 + x1, y0 + y1, src,
+                           self.brightness(x1, y1, x2, y2))
+
+    # find candidates in the downscaled frames, then search windows around
+    # them in the full resolution frames
+    def coarseToFine(self, search):
+        c = self.coarse
+        if self.detector.windowed:
+            self.thresh = threshold(self.small, c, c.get('mask'),
+                                    c['kernel'], self.coarseDetector)
+        else:
+            self.thresh = morph(self.coarseForeground, c['thresh'],
+                                c['temp'], c['kernel'])
+
+        if not search:
+            return []
+
+        np.copyto(c['contours'], self.thresh)
+        contours, hierarchy = cv2.findContours(c['contours'],
+                                               cv2.RETR_EXTERNAL,
+                                               cv2.CHAIN_APPROX_SIMPLE)
+
+        s = self.scale
+        h, w = self.grayed[0].shape
+        windows = []
+
+        for contour in contours:
+
+            # anything much bigger than a ball can't be one at full res
+            if cv2.contourArea(contour) * s * s > 2 * self.max_area:
+                continue
+
+            # pad the windows so the full resolution morph ops see the whole
+            # blob, which can be bigger than it looked when downscaled
+            x, y, bw, bh = cv2.boundingRect(contour)
+            pad = 2 * self.kernel.shape[0] + s * max(bw, bh)
+            windows.append([max(x * s - pad, 0), max(y * s - pad, 0),
+                            min((x + bw) * s + pad, w),
+                            min((y + bh) * s + pad, h)])
+
+        found = []
+        for x1, y1, x2, y2 in mergeWindows(windows):
+            found.extend(self.searchWindow(x1, y1, x2, y2))
+
+        return found
+
+    # search a thresholded image for candidates. x0, y0 is the offset of the
+    # searched image within the whole frame, src the image to annotate and
+    # gray the grayscale image to weight centroids with.
+    # The filters run over every contour at once, a noisy frame can have
+    # hundreds of them.
+    def search(self, thresh, x0=0, y0=0, src=None, gray=None):
+        found = []
+
+        # find contours in threshold
+        contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL,
+                                               cv2.CHAIN_APPROX_SIMPLE)
+        if len(contours) == 0:
+            return found
+
+        areas, boxes = contourStats(contours)
+        x, y, w, h = boxes.T
+
+        # filter by size/area, then by squareness/aspect ratio
+        sized = (areas < self.max_area) & (areas > self.min_area)
+        detected = sized & square(h, w) & circular(areas, h, w)
+
+        # Get central coords of the detections
+        hits = np.flatnonzero(detected)
+        if self.centroid == 'box' or len(hits) == 0:
+            cx = x[hits] + w[hits] / 2.0
+            cy = y[hits] + h[hits] / 2.0
+        else:
+            cx, cy = contourCentroids([contours[i] for i in hits])
+            if gray is not None:
+                weighted(gray, [contours[i] for i in hits], boxes[hits],
+                         cx, cy)
+
+        cx = (x0 + cx).tolist()
+        cy = (-1 * (y0 + cy)).tolist()
+
+        # POINT: X / Y / FRAME / PID
+        for i in xrange(len(hits)):
+            self.point_index += 1
+            found.append((cx[i], cy[i], self.time, self.point_index))
+
+        # label the size filtered contours as (area, box, detected)
+        if src is not None:
+            labels = [(areas[i], tuple(boxes[i]), detected[i])
+                      for i in np.flatnonzero(sized).tolist()]
+            annotate(src, contours, labels)
+
+        self.detections.extend(found)
+        return found
+
+
+# The points of a list of contours end to end: x, y, the index each contour
+# starts at, and the index of the point after each one around its contour
+def outline(contours):
+    lengths = np.array([len(c) for c in contours])
+    starts = np.cumsum(lengths) - lengths
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+
+    after = np.arange(1, len(points) + 1)
+    after[starts + lengths - 1] = starts
+    return points[:, 0], points[:, 1], starts, after
+
+
+# Areas and bounding boxes (x, y, w, h) of a list of contours, as
+# cv2.contourArea and cv2.boundingRect give them, worked out for all of the
+# contours together
+def contourStats(contours):
+    x, y, starts, after = outline(contours)
+
+    # shoelace formula, each point paired with the next one around its
+    # contour. The products are exact, so the sums match contourArea's
+    cross = x[after] * y - y[after] * x
+    areas = np.abs(np.add.reduceat(cross, starts).astype(float)) / 2.0
+
+    x1 = np.minimum.reduceat(x, starts)
+    y1 = np.minimum.reduceat(y, starts)
+    boxes = np.column_stack((x1, y1,
+                             np.maximum.reduceat(x, starts) - x1 + 1,
+                             np.maximum.reduceat(y, starts) - y1 + 1))
+    return areas, boxes
+
+
+# Centroids (x, y) of a list of contours from their zeroth and first moments
+# (Green's theorem over each outline), worked out for all of them together.
+# Contour points are pixel centres, the centroids are shifted half a pixel so
+# they're in the same coordinates as the bounding box centres.
+def contourCentroids(contours):
+    x, y, starts, after = outline(contours)
+
+    cross = x[after] * y - y[after] * x
+    m00 = np.add.reduceat(cross, starts).astype(float)
+    m10 = np.add.reduceat((x + x[after]) * cross, starts) / 3.0
+    m01 = np.add.reduceat((y + y[after]) * cross, starts) / 3.0
+
+    # no area to speak of, fall back to the middle of the outline
+    flat = m00 == 0
+    m00[flat] = 1
+    cx = m10 / m00 + 0.5
+    cy = m01 / m00 + 0.5
+    if flat.any():
+        cx[flat] = (np.maximum.reduceat(x, starts) +
+                    np.minimum.reduceat(x, starts))[flat] / 2.0 + 0.5
+        cy[flat] = (np.maximum.reduceat(y, starts) +
+                    np.minimum.reduceat(y, starts))[flat] / 2.0 + 0.5
+
+    return cx, cy
+
+
+# Refine centroids cx, cy in place with the brightness of gray inside each
+# contour. Brightness is taken above the darkest pixel in the blob, so the
+# background the morph ops grew the blob into hardly counts.
+def weighted(gray, contours, boxes, cx, cy):
+    for i, (x, y, w, h) in enumerate(boxes.tolist()):
+        inside = np.zeros((h, w), np.uint8)
+        cv2.drawContours(inside, contours, i, 255, -1, offset=(-x, -y))
+
+        patch = gray[y:y + h, x:x + w].astype(np.float32)
+        patch -= patch[inside > 0].min()
+        patch[inside == 0] = 0
+
+        m = cv2.moments(patch)
+        if m['m00'] > 0:
+            cx[i] = x + m['m10'] / m['m00'] + 0.5
+            cy[i] = y + m['m01'] / m['m00'] + 0.5
+
+
+# Draw the contours onto the source image, label the size filtered ones with
+# their area and box the detections
+def annotate(src, contours, labels):
+    if len(contours) > 0:
+        cv2.drawContours(src, contours, -1, (0, 255, 0), 3)
+
+    for area, (x, y, w, h), detected in labels:
+        cv2.putText(src, str(area), (x, y),
+                    cv2.FONT_HERSHEY_PLAIN, 0.8, (255, 255, 255))
+        if detected:
+            cv2.rectangle(src, (x, y), (x + w, y + h), (0, 0, 255), 2)
+
+
+# Online tracking: the most candidate tracks followed at once, and what a
+# candidate has to do to be confirmed. It has to be verified in at least
+# confirm_length frames, and be moving at confirm_speed pixels a frame (at
+# 720p, scaled to the clip) or more on average since it was seeded, so blobs
+# jittering about or wandering across the frame (noise, flags, people) don't
+# gate the search.
+max_candidates = 64
+confirm_length = 5
+confirm_speed = 12
+
+
+# A single track followed by the online tracker, in its row of the tracker's
+# bank of filters
+class Track(object):
+
+    def __init__(self, row, b0, b1):
+        self.row = row
+        self.length = 2
+        self.misses = 0
+        self.predicted = None
+        self.v_dist = kalman.min_v_dist
+
+        # where it was seeded, where it was last seen and the frames between
+        self.origin = b0[:2]
+        self.last = b1[:2]
+        self.frames = 1
+
+    # average speed in pixels a frame since it was seeded
+    def speed(self):
+        dx = self.last[0] - self.origin[0]
+        dy = self.last[1] - self.origin[1]
+        return ((dx ** 2) + (dy ** 2)) ** 0.5 / self.frames
+
+
+# Online tracking-by-detection using kalman.py's filter and parameters.
+#
+# Candidate tracks are seeded from pairs of detections in consecutive frames,
+# as in kalman.py, looking up the pairs in a spatial grid of each frame's
+# detections. Every track is a row of one bank of filters, so they're all
+# predicted and corrected together, and there are never more than capacity
+# (max_candidates) of them: seeds with no free row are dropped until some
+# tracks end.
+#
+# The longest candidate that passes the confirmation test (see
+# confirm_length and confirm_speed) becomes the confirmed track and the
+# other candidates are dropped. While there is a confirmed track only its
+# gate is searched, until it misses kalman.max_misses frames in a row and
+# full frame searching starts again.
+class Tracker(object):
+
+    def __init__(self, confirm=None, speed=None, capacity=None):
+        self.confirm = setting('confirm_length', confirm)
+        self.speed = setting('confirm_speed', speed)
+        self.capacity = setting('max_candidates', capacity)
+
+        self.kf = kalman.KalmanFilter(self.capacity)
+        self.free = range(self.capacity - 1, -1, -1)
+        self.tracks = []
+        self.confirmed = None
+        self.previous = []
+
+    # predict every track forward a frame, and return the gate (x, y, radius)
+    # of the confirmed track if there is one
+    def predict(self):
+        if len(self.tracks) > 0:
+            predicted = self.kf.predict([t.row for t in self.tracks])
+
+            # verifying distance is a fraction of the speed, as in kalman.py
+            speed = np.hypot(predicted[:, 2], predicted[:, 3])
+            v_dist = np.maximum(speed / kalman.denom, kalman.min_v_dist)
+
+            for t, p, v in zip(self.tracks, predicted.tolist(),
+                               v_dist.tolist()):
+                t.predicted = tuple(p)
+                t.v_dist = v
+                t.frames += 1
+
+        if self.confirmed is None:
+            return None
+
+        p = self.confirmed.predicted
+        return (p[0], p[1], self.confirmed.v_dist)
+
+    # verify and correct the tracks against this frame's detections, then
+    # confirm, drop or seed tracks
+    def update(self, found):
+        grid = kalman.build_grid([p[0] for p in found], [p[1] for p in found])
+        verifying = set()
+        rows = []
+        measured = []
+
+        for t in self.tracks:
+            p = t.predicted
+            nearby = kalman.grid_query(grid, p[0], p[1], t.v_dist)
+            point = nearest(p, [found[i] for i in nearby], t.v_dist)
+
+            if point is None:
+                t.misses += 1
+            else:
+                rows.append(t.row)
+                measured.append(point[:2])
+                t.misses = 0
+                t.length += 1
+                t.last = point[:2]
+                verifying.add(point[3])
+
+        if len(rows) > 0:
+            self.kf.correct(measured, rows)
+
+        self.keep([t for t in self.tracks if t.misses < kalman.max_misses])
+
+        # confirmed track lost
+        if self.confirmed is not None and self.confirmed not in self.tracks:
+            self.confirmed = None
+
+        if self.confirmed is None:
+            passed = [t for t in self.tracks
+                      if t.length >= self.confirm and t.speed() >= self.speed]
+            if len(passed) > 0:
+                self.confirmed = max(passed, key=lambda t: t.length)
+                self.keep([self.confirmed])
+
+        # seed from nearby pairs, unless the point is already being followed
+        if self.confirmed is None:
+            self.seed(found, grid, verifying)
+
+        self.previous = found
+
+    # keep just the given tracks, freeing the rows of the rest
+    def keep(self, tracks):
+        kept = set(t.row for t in tracks)
+        self.free.extend(t.row for t in self.tracks if t.row not in kept)
+        self.tracks = tracks
+
+    # start a track for each pair of a previous frame's detection and a
+    # nearby one in this frame, while there are rows free
+    def seed(self, found, grid, verifying):
+        for b0 in self.previous:
+            for i in kalman.grid_query(grid, b0[0], b0[1], kalman.init_dist):
+                b1 = found[i]
+                if b1[3] in verifying:
+                    continue
+
+                near, sep = kalman.point_is_near_point(b0, b1,
+                                                       kalman.init_dist)
+                if not near:
+                    continue
+
+                if len(self.free) == 0:
+                    return
+
+                row = self.free.pop()
+                kalman.setPostState(self.kf, b1[0], b1[1], b1[0] - b0[0],
+                                    b1[1] - b0[1], 0, 0, row)
+                self.kf.error_cov_post[row] = kalman.initial_error_cov()
+                self.tracks.append(Track(row, b0, b1))
+
+
+# nearest of the points to the predicted point within distance, or None
+def nearest(predicted, points, distance):
+    best = None
+    min_sep = distance
+
+    for point in points:
+        near, sep = kalman.point_is_near_point(predicted, point, distance)
+        if near and sep < min_sep:
+            min_sep = sep
+            best = point
+
+    return best
+
+
+# Turn a roi (None, rectangle, mask or mask filename) into the rectangle to
+# process and the mask cropped to it, or None if there is no mask
+def regionOfInterest(roi, shape):
+    h, w = shape
+
+    if roi is None:
+        return (0, 0, w, h), None
+
+    if isinstance(roi, str):
+        roi = cv2.imread(roi, 0)
+        if roi is None:
+            raise IOError("Could not read roi mask")
+
+    if isinstance(roi, np.ndarray):
+        ys, xs = np.nonzero(roi)
+        if len(xs) == 0:
+            raise ValueError("roi mask is empty")
+        x, y = xs.min(), ys.min()
+        rect = (x, y, xs.max() + 1 - x, ys.max() + 1 - y)
+        mask = roi[y:y + rect[3], x:x + rect[2]]
+        return rect, np.where(mask > 0, 255, 0).astype(np.uint8)
+
+    # clip a rectangle to the frame
+    x, y, rw, rh = [int(v) for v in roi]
+    x = min(max(x, 0), w - 1)
+    y = min(max(y, 0), h - 1)
+    return (x, y, min(rw, w - x), min(rh, h - y)), None
+
+
+# merge any overlapping windows [x1, y1, x2, y2] into their bounding windows
+def mergeWindows(windows):
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(windows)):
+            for j in range(i + 1, len(windows)):
+                a = windows[i]
+                b = windows[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    windows[i] = [min(a[0], b[0]), min(a[1], b[1]),
+                                  max(a[2], b[2]), max(a[3], b[3])]
+                    windows.pop(j)
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return windows
+
+
+# Size bounds (min_area, max_area) for frames of the given height
+def scaledAreas(height):
+    s = (float(height) / reference_height) ** 2
+    return min_area * s, max_area * s
+
+
+# A square structuring element k scaled for frames of the given height, kept
+# odd sized so it stays centred
+def scaledKernel(k, height):
+    size = int(k.shape[0] * float(height) / reference_height) | 1
+    if size == k.shape[0]:
+        return k
+    return np.ones((size, size), np.uint8)
+
+
+# Tune a detector backend's threshold and min_area to a clip from its first
+# count frames (warmup), returned as DetectionEngine settings. detector is
+# the backend the settings are for, the detector setting by default.
+#
+# The frame to frame noise is measured by the median absolute difference
+# between frames, and the backend sets its threshold from it (see tuned() in
+# the backends). min_area is then raised from the scaled default until the
+# backend leaves no more than blobs (max_blobs) detections a frame on average.
+def tune(path, count=None, blobs=None, detector=None):
+    count = setting('warmup', count)
+    blobs = setting('max_blobs', blobs)
+    detector = setting('detector', detector)
+    backend = detectors.get(detector, detector)
+
+    source = frames.FrameSource(path, count=count)
+    grayed = [cv2.cvtColor(f, cv2.COLOR_RGB2GRAY) for f in source]
+    source.release()
+
+    if len(grayed) < 3:
+        return {}
+
+    low, high = scaledAreas(grayed[0].shape[0])
+
+    # noise as a robust standard deviation, from a sparse sample of pixels
+    sample = [cv2.absdiff(a, b)[::4, ::4] for a, b in zip(grayed, grayed[1:])]
+    sigma = 1.4826 * np.median(np.concatenate(sample, axis=None))
+
+    settings = {}
+    thresh = None
+    if hasattr(backend, 'tuned'):
+        thresh = backend.tuned(sigma)
+    if thresh is not None:
+        settings['thresh'] = thresh
+
+    # what the detections would be, sizes and all. The frames go through in
+    # order, so the background models learn from them as they would
+    model = backend(**settings)
+    k = scaledKernel(model.kernel, grayed[0].shape[0])
+    sizes = []
+    for i in xrange(len(grayed) - 2):
+        image = threshold(grayed[i:i + 3], {}, None, k, model)
+        contours, hierarchy = cv2.findContours(image, cv2.RETR_EXTERNAL,
+                                               cv2.CHAIN_APPROX_SIMPLE)
+        if len(contours) == 0:
+            continue
+
+        areas, boxes = contourStats(contours)
+        x, y, w, h = boxes.T
+        kept = (areas < high) & (areas > low) & square(h, w) & \
+            circular(areas, h, w)
+        sizes.extend(areas[kept].tolist())
+
+    # keep the biggest of them, as many as are allowed
+    allowed = blobs * (len(grayed) - 2)
+    if len(sizes) > allowed:
+        low = max(low, sorted(sizes)[-allowed - 1])
+
+    settings.update({'min_area': low, 'max_area': high})
+    return settings
+
+
+# Run the detection engine over a whole video or image sequence. Headless
+# unless annotated names a video to write the annotated frames to. With auto
+# on, settings not given are tuned to the clip. With skip_idle on only the
+# active segments are searched, the annotated video needs every frame though.
+# Both default to the module settings. If stats is given its 'frames' is set
+# to the number of frames fed to the engine.
+def detectClip(path, annotated=None, auto=None, skip_idle=None, stats=None,
+               **kwargs):
+    auto = setting('auto', auto)
+    skip_idle = setting('skip_idle', skip_idle)
+
+    if auto:
+        kwargs = dict(tune(path, detector=kwargs.get('detector')), **kwargs)
+
+    if skip_idle and annotated is None:
+        return detectParallel(path, 1, auto=False, skip_idle=True,
+                              stats=stats, **kwargs)
+
+    if annotated is not None:
+        kwargs['annotate'] = True
+
+    engine = DetectionEngine(**kwargs)
+    source = frames.FrameSource(path)
+
+    sink = None
+    if annotated is not None:
+        sink = frames.FrameSink(annotated, source.fps)
+
+    for frame in source:
+        spare = engine.spare()
+        engine.feed(frame)
+        if sink is not None and engine.fed >= 3:
+            sink.write(engine.frames[1])
+        source.recycle(spare)
+
+    source.release()
+    if sink is not None:
+        sink.release()
+    if stats is not None:
+        stats['frames'] = engine.fed
+    return engine.detections
+
+
+# Number of frames in a video or image sequence, 0 if it can't be told. For
+# a video it's the container's count, which can be a few frames out.
+def frameCount(path):
+    if os.path.isdir(path):
+        return len(glob.glob(path + '/frame_*.png'))
+
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(cv.CV_CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return max(count, 0)
+
+
+# Run the engine over a chunk of a clip, searching frames start to end-1, or
+# on to the end of the clip if end is None. The three-frame diff needs the
+# frame either side, so the chunk is read with one frame of overlap at each
+# end.
+def detectRange(job):
+    return searchRange(job)[0]
+
+
+# detectRange, also giving the number of frames fed to the engine
+def searchRange(job):
+    path, start, end, kwargs = job
+
+    count = None
+    if end is not None:
+        count = end - start + 2
+
+    engine = DetectionEngine(start=start - 1, **kwargs)
+    source = frames.FrameSource(path, start=start - 1, count=count)
+
+    for frame in source:
+        spare = engine.spare()
+        engine.feed(frame)
+        source.recycle(spare)
+
+    source.release()
+    return engine.detections, engine.fed
+
+
+# Split the clip into chunks, detect in each one in a process pool and merge.
+# Settings are tuned once for the whole clip, with auto on. With skip_idle on
+# the chunks only cover the clip's active segments, and with a single worker
+# they're run in this process. Both default to the module settings. If stats
+# is given its 'frames' is set to the number of frames fed to the engines,
+# counting the frames the chunks overlap by each time.
+def detectParallel(path, workers=None, chunk=None, auto=None, skip_idle=None,
+                   stats=None, **kwargs):
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    auto = setting('auto', auto)
+    skip_idle = setting('skip_idle', skip_idle)
+
+    if auto:
+        kwargs = dict(tune(path, detector=kwargs.get('detector')), **kwargs)
+
+    # Frames 1 to n-2 are searched, the first and last only feed the diff
+    if skip_idle:
+        segments = activity.activeSegments(path)
+    else:
+        n = frameCount(path)
+        if n < 3 or workers < 2:
+            return detectClip(path, auto=False, skip_idle=False,
+                              stats=stats, **kwargs)
+        segments = [(1, n - 1)]
+
+    if chunk is None:
+        active = sum(end - start for start, end in segments)
+        chunk = max(int(math.ceil(float(active) / workers)), 1)
+
+    jobs = []
+    for first, last in segments:
+        for start in xrange(first, last, chunk):
+            jobs.append((path, start, min(start + chunk, last), kwargs))
+
+    # frameCount can be out, so the last chunk goes on to the real end of
+    # the clip. The active segments are counted as they're decoded.
+    if not skip_idle:
+        jobs[-1] = (path, jobs[-1][1], None, kwargs)
+
+    if workers < 2:
+        results = map(searchRange, jobs)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(searchRange, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    if stats is not None:
+        stats['frames'] = sum(fed for found, fed in results)
+
+    # Chunks come back in order, so renumbering the point IDs as they are
+    # merged gives the same IDs the serial run would have given
+    detections = []
+    point_index = 0
+    for found, fed in results:
+        for d in found:
+            point_index += 1
+            detections.append((d[0], d[1], d[2], point_index))
+
+    return detections
+
+
+# Write detections out as: X / Y / FRAME / PID
+def writeDetections(detections, filename, fmt=str):
+    if records.binary(filename):
+        records.save(filename, records.pack(detections, records.DETECTION))
+        return
+
+    outfile = open(filename, 'w')
+
+    for d in detections:
+        outfile.write(fmt(d[0]) + ' ' + fmt(d[1]) + ' ' +
+                      fmt(d[2]) + ' ' + fmt(d[3]) + '\n')
+
+    outfile.close()
 
 
 def main():
     global cap
-    global outfile
+    global sink
     global truthfile
 
     # Keycodes for acioning
     keys = {-1: cont, 116: track, 112: pause, 113: quit, 100: showDifference}
 
     if len(sys.argv) < 2:
-        print "Usage : ./detect.py <image_sequence> *<outfile>* *<view>*"
+        print "Usage : ./detect.py <image_sequence> *<outfile>* *<view>*" + \
+            " *<workers>* *<annotated_video>*"
         sys.exit(0)
 
+    # Default to showing the detection streams, suppress if told to
+    view = True
+    try:
+        if sys.argv[3] == 'suppress':
+            view = False
+    except IndexError:
+        pass
+
     path = sys.argv[1]
 
+    # Parallel detection is headless, just write out the results
+    try:
+        workers = int(sys.argv[4])
+    except IndexError:
+        workers = 0
+
+    try:
+        annotated = sys.argv[5]
+    except IndexError:
+        annotated = None
+
+    # Skipping idle frames is headless too
+    if skip_idle and not view and annotated is None:
+        print "> SKIPPING IDLE FRAMES"
+        workers = max(workers, 1)
+
+    if workers > 0:
+        if annotated is not None:
+            print "WARN: No annotated video from a parallel run"
+        print "> PARALLEL:", workers, "workers"
+        detections = detectParallel(path, workers)
+        writeDetections(detections, 'data/data_detections.txt', repr)
+        if len(sys.argv) > 2:
+            writeDetections(detections, sys.argv[2])
+        return
+
     # Supplied path can be a directory containing an image sequence: 00001.png
     if os.path.isdir(path):
         print "> INPUT: Image Sequence"
-        truthfile = open('ground_truth.txt', 'w')
         path = path + '/frame_%05d.png'
     else:
         print "> INPUT: Video File"
-        truthfile = open('ground_truth.txt', 'w')
 
-    # Otherwise just go and get the video file
-    cap = cv2.VideoCapture(path)
+    # Clicks on the feed are saved as ground truth
+    if view:
+        truthfile = open('ground_truth.txt', 'w')
 
-    outfile = open('data/data_detections.txt', 'w')
+    settings = {}
+    if auto:
+        settings = tune(path)
+        print "> TUNED:", settings
 
-    # Read first three frames for initialisation
-    ret, frame0 = cap.read()
-    grayed0 = cv2.cvtColor(frame0, cv2.COLOR_RGB2GRAY)
+    # Otherwise just go and get the video file, decoded ahead on a thread
+    cap = frames.FrameSource(path)
+    engine = DetectionEngine(annotate=view or annotated is not None,
+                             **settings)
 
-    ret, frame1 = cap.read()
-    grayed1 = cv2.cvtColor(frame1, cv2.COLOR_RGB2GRAY)
+    if annotated is not None:
+        sink = frames.FrameSink(annotated, cap.fps)
 
-    ret, frame2 = cap.read()
-    grayed2 = cv2.cvtColor(frame2, cv2.COLOR_RGB2GRAY)
+    outfile = open('data/data_detections.txt', 'w')
+    startOfFile = True
 
     # Get on with the capture
     while(cap.isOpened()):
 
-        temp = frame1  # without contours
-
-        # 3-frame difference image and morphological ops
-        current = diff(grayed0, grayed1, grayed2)
-        current = morph(current)
-
-        temp_thresh = current.copy()
+        ret, frame = cap.read()
+        if ret is not True:
+            break
 
         # Frame1 gets modified with contours
-        if tracking:
-            search(frame1, temp_thresh)
-
-        if view:
-            cv2.namedWindow('Feed')
-            cv2.setMouseCallback('Feed', click)
-            cv2.imshow('Feed', frame1)
-
-            if showDiff:
-                cv2.imshow('Threshold Image', current)  # why does this go odd
-            else:
-                cv2.destroyWindow('Threshold Image')
+        spare = engine.spare()
+        found = engine.feed(frame, tracking)
+        if sink is not None and engine.fed >= 3:
+            sink.write(engine.frames[1])
+        cap.recycle(spare)
+
+        # Still filling up the first three frames
+        if engine.thresh is None:
+            continue
+
+        for d in found:
+            if not startOfFile:
+                outfile.write('\n')
+
+            # Write to file
+            outfile.write(repr(d[0]) + ' ' + repr(d[1]) + ' ' +
+                          repr(d[2]) + ' ' + repr(d[3]))
+            startOfFile = False
+
+        # Headless, there's no display or keys to deal with
+        if not view:
+            continue
+
+        cv2.namedWindow('Feed')
+        cv2.setMouseCallback('Feed', click, engine)
+        cv2.imshow('Feed', engine.frames[1])
+
+        if showDiff:
+            cv2.imshow('Threshold Image', engine.thresh)
+        else:
+            cv2.destroyWindow('Threshold Image')
 
         if paused:
             # Wait indefinitely for a keypress
@@ -131,139 +1153,211 @@ def main():
             # Q - quit everything
             if key == 113:
                 cap.release()
+                if sink is not None:
+                    sink.release()
                 cv2.destroyAllWindows()
                 outfile.close()
                 sys.exit()
 
-        # Read next frame
-        ret, next_frame = cap.read()
-
-        # Shuffle the frames along 0=1 1=2 2=next
-        if ret is True:
-            frame0 = temp
-            grayed0 = grayed1
-
-            frame1 = frame2
-            grayed1 = grayed2
-
-            frame2 = next_frame
-            grayed2 = cv2.cvtColor(next_frame, cv2.COLOR_RGB2GRAY)
-
-            # If a key has been pressed, route it to the relevant mode-toggle
-            try:
-                keys[cv2.waitKey(1)]()
-            except KeyError:
-                continue
-        else:
-            break
+        # If a key has been pressed, route it to the relevant mode-toggle
+        try:
+            keys[cv2.waitKey(1)]()
+        except KeyError:
+            continue
 
     cap.release()
-    cv2.destroyAllWindows()
+    if sink is not None:
+        sink.release()
+    if view:
+        cv2.destroyAllWindows()
     outfile.close()
 
+    # Check for a dedicated outfile (in addition to the standard)
+    try:
+        writeDetections(engine.detections, sys.argv[2])
+    except IndexError:
+        pass
+
 
-# returns a thresholded difference image between 3-frames
-def diff(f0, f1, f2):
-    d1 = cv2.absdiff(f2, f1)
-    d2 = cv2.absdiff(f1, f0)
-    overlap = cv2.bitwise_and(d1, d2)
+# returns a thresholded difference image between 3-frames.
+# d1, d2 and dst are optional preallocated buffers, dst holds the result
+def diff(f0, f1, f2, d1=None, d2=None, dst=None, thresh=40):
+    d1 = cv2.absdiff(f2, f1, d1)
+    d2 = cv2.absdiff(f1, f0, d2)
+    overlap = cv2.bitwise_and(d1, d2, dst)
 
     # binary threshold(src, thresh, maxval, type)
-    ret, thresh = cv2.threshold(overlap, 40, 255, cv2.THRESH_BINARY)
+    ret, thresh = cv2.threshold(overlap, thresh, 255, cv2.THRESH_BINARY,
+                                overlap)
     return thresh
 
 
-# returns a re-thresholded image after blur and open/close/erode/dilate
-def morph(image):
-    kernel = np.ones((11, 11), np.uint8)
-    image = cv2.dilate(image, kernel)
-    image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
-    image = cv2.GaussianBlur(image, (11, 11), 0)
-    ret, image = cv2.threshold(image, 40, 255, cv2.THRESH_BINARY)
-    return image
+# Structuring element for the morphological ops
+kernel = np.ones((11, 11), np.uint8)
 
+# Tuned thresholds are this many noise deviations, within bounds
+noise_factor = 8
+min_thresh = 20
+max_thresh = 80
 
-# search a frame for candidates
-def search(src, thresh):
-    global detections
-    global point_index
-    global outfile
-    global startOfFile
-    global time
-    time += 1
-    objectDetected = False
 
-    # find contours in threshold
-    contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL,
-                                           cv2.CHAIN_APPROX_SIMPLE)
+# returns a re-thresholded image after blur and open/close/erode/dilate.
+# dst and temp are optional preallocated buffers, dst holds the result
+def morph(image, dst=None, temp=None, k=kernel):
+    temp = cv2.dilate(image, k, temp)
+    dst = cv2.morphologyEx(temp, cv2.MORPH_CLOSE, k, dst)
+    temp = cv2.GaussianBlur(dst, k.shape, 0, temp)
+    ret, dst = cv2.threshold(temp, 40, 255, cv2.THRESH_BINARY, dst)
+    return dst
 
-    if len(contours) > 0:
-        objectDetected = True
-    else:
-        objectDetected = False
 
-    # draw the contours onto the source image
-    if objectDetected:
-        cv2.drawContours(src, contours, -1, (0, 255, 0), 3)
-        for contour in contours:
+# the detector's foreground for the middle of three grayscale frames, masked
+# if given a mask. buffers maps names to preallocated images, missing ones are
+# allocated
+def foreground(detector, grayed, buffers, mask=None):
+    overlap = detector.foreground(grayed, buffers)
+
+    if mask is not None:
+        cv2.bitwise_and(overlap, mask, overlap)
+
+    return overlap
+
+
+# foreground and morph three grayscale frames, by 3-frame differencing
+# unless given another detector
+def threshold(grayed, buffers, mask=None, k=kernel, detector=None):
+    if detector is None:
+        detector = FrameDifference()
+
+    b = buffers
+    overlap = foreground(detector, grayed, b, mask)
+    return morph(overlap, b.get('thresh'), b.get('temp'), k)
+
+
+# Detector backends. foreground(grayed, buffers) returns the binary
+# foreground image of the middle of the latest three grayscale frames, in
+# buffers['overlap'] if there is one, for the morph ops to clean up with the
+# backend's kernel.
+#
+# windowed backends only look at the frames they're given, so they can be run
+# on a window of the frames on its own. The others model the background and
+# have to see the whole of every frame.
+#
+# tuned(sigma) gives the backend's threshold for a clip whose frames differ
+# by sigma from one to the next through noise alone, or None if the backend
+# takes care of the noise itself (see tune).
+
+# The moving ball is wherever both of the neighbouring frames differ from the
+# middle one. Cheap and stateless, but misses slow balls and picks up camera
+# shake.
+class FrameDifference(object):
+
+    windowed = True
+
+    # joins up the fragments of the differenced ball
+    kernel = kernel
 
-            area = cv2.contourArea(contour)
+    def __init__(self, thresh=40):
+        self.thresh = thresh
 
-            # filter by size/area
-            if area < max_area and area > min_area:
+    # both differences have to clear it, well above the noise
+    @staticmethod
+    def tuned(sigma):
+        return int(np.clip(noise_factor * sigma, min_thresh, max_thresh))
 
-                # Get the bounding box and label contours with area
-                x, y, w, h = cv2.boundingRect(contour)
-                cv2.putText(src, str(area), (x, y), cv2.FONT_HERSHEY_PLAIN,
-                            0.8, (255, 255, 255))
+    def foreground(self, grayed, buffers):
+        b = buffers
+        return diff(grayed[0], grayed[1], grayed[2],
+                    b.get('d1'), b.get('d2'), b.get('overlap'), self.thresh)
 
-                # filter by squareness/aspect ratio
-                if square(h, w) and circular(area, h, w):
-                    point_index += 1
 
-                    # Draw the bounding box if detected
-                    cv2.rectangle(src, (x, y), (x + w, y + h), (0, 0, 255), 2)
+# Foreground is wherever the middle frame differs from a running average of
+# the frames before it, which adapts to the scene at rate alpha. Still finds
+# a ball that's barely moving between frames.
+class RunningAverage(object):
 
-                    # Get central coords
-                    cx = x + float(w) / 2.0
-                    cy = -1 * (y + float(h) / 2.0)
+    windowed = False
 
-                    # Create and append detection
-                    d = (cx, cy, time, point_index)
-                    detections.append(d)
+    # the ball comes out whole, just tidy up its edges
+    kernel = np.ones((3, 3), np.uint8)
 
-                    if not startOfFile:
-                        outfile.write('\n')
+    def __init__(self, alpha=0.05, thresh=25):
+        self.alpha = alpha
+        self.thresh = thresh
+        self.background = None
 
-                    # Write to file
-                    outfile.write(repr(cx) + ' ' + repr(cy) + ' ' +
-                                  repr(time) + ' ' + repr(point_index))
+    # the average has next to no noise of its own, so the difference from
+    # it only carries one frame's noise: sigma / sqrt(2)
+    @staticmethod
+    def tuned(sigma):
+        return int(np.clip(noise_factor * sigma / math.sqrt(2), min_thresh,
+                           max_thresh))
+
+    def foreground(self, grayed, buffers):
+        b = buffers
+        frame = grayed[1]
+        if self.background is None:
+            self.background = grayed[0].astype(np.float32)
 
-                    if startOfFile is True:
-                        startOfFile = False
+        average = cv2.convertScaleAbs(self.background, b.get('d1'))
+        difference = cv2.absdiff(frame, average, b.get('d2'))
+        ret, fg = cv2.threshold(difference, self.thresh, 255,
+                                cv2.THRESH_BINARY, b.get('overlap'))
+
+        cv2.accumulateWeighted(frame, self.background, self.alpha)
+        return fg
 
 
-# test aspect ratio
+# OpenCV's adaptive gaussian mixture background model (MOG2), per pixel
+# mixtures of gaussians learned over history frames
+class MixtureOfGaussians(object):
+
+    windowed = False
+    kernel = RunningAverage.kernel
+
+    def __init__(self, history=200, thresh=16):
+        # OpenCV 3 and later make one with a factory function, the class is
+        # abstract there
+        if hasattr(cv2, 'createBackgroundSubtractorMOG2'):
+            self.model = cv2.createBackgroundSubtractorMOG2(history, thresh,
+                                                            False)
+        else:
+            self.model = cv2.BackgroundSubtractorMOG2(history, thresh, False)
+
+    # thresh is MOG2's varThreshold, a squared distance in units of the
+    # variance the model learns for each pixel, so it's relative to the noise
+    # already
+    @staticmethod
+    def tuned(sigma):
+        return None
+
+    def foreground(self, grayed, buffers):
+        fg = self.model.apply(grayed[1], buffers.get('overlap'))
+
+        # the model is soft at the edges of the foreground
+        ret, fg = cv2.threshold(fg, 127, 255, cv2.THRESH_BINARY, fg)
+        return fg
+
+
+detectors = {'diff': FrameDifference,
+             'average': RunningAverage,
+             'mog': MixtureOfGaussians}
+
+
+# test aspect ratio, of single boxes or arrays of them
 def square(h, w):
-    shorter = min((h, w))
-    longer = max((h, w))
-    squareness = abs((float(longer) / float(shorter)) - 1)
-    if squareness < 0.5:
-        return True
-    else:
-        return False
+    shorter = np.minimum(h, w)
+    longer = np.maximum(h, w)
+    squareness = np.abs((np.asarray(longer, float) / shorter) - 1)
+    return squareness < 0.5
 
 
 # if perfectly circular then ration of areas: contour/box = pi/4
 def circular(area, h, w):
-    ratio = float(area) / (float(h) * float(w))
+    ratio = np.asarray(area, float) / (np.asarray(h, float) * w)
     pi4 = (3.142 / 4.0)
-    closeness = abs(ratio - pi4)
-
-    if closeness < 0.4:
-        return True
-    else:
-        return False
+    closeness = np.abs(ratio - pi4)
+    return closeness < 0.4
 
 
 # Toggle whether or not to draw the contours/boxes
@@ -300,21 +1394,11 @@ def cont():
 def quit():
     global cap
     cap.release()
+    if sink is not None:
+        sink.release()
     cv2.destroyAllWindows()
     sys.exit(0)
 
-# Procedural body
-main()
-
-# Check for a dedicated outfile (in addition to the standard)
-try:
-    outfile = open(sys.argv[2], 'w')
-
-    for d in detections:
-        outfile.write(str(d[0]) + ' ' + str(d[1]) + ' ' +
-                      str(d[2]) + ' ' + str(d[3]) + '\n')
-
-    outfile.close()
 
-except IndexError:
-    pass
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+''' frames.py
+
+Prefetching frame source for video files and image sequences.
+
+A FrameSource decodes frames on a background thread into a bounded queue
+while the caller works on the ones already decoded. OpenCV lets go of the
+GIL while it decodes and converts, so the two really do run side by side.
+It reads like a cv2.VideoCapture:
+
+    source = frames.FrameSource(path)
+    while source.isOpened():
+        ret, frame = source.read()
+        ...
+    source.release()
+
+or can just be iterated over. Reading can start part way through (start=),
+from the same frame a read from the beginning would get to (see
+trust_seek). Frames can optionally be colour converted on the reader thread
+too (convert=cv2.COLOR_RGB2GRAY etc.), and a caller that is finished with a
+frame can hand it back with recycle() for the reader to decode the next one
+into.
+
+A FrameSink writes frames back out to a video file, eg. annotated frames for
+debugging.
+
+'''
+
+import os.path
+import threading
+import Queue
+import cv2
+import cv2.cv as cv
+
+# frames decoded ahead of the caller
+queue_size = 8
+
+# frame rate to write at when the source doesn't have one (image sequences)
+default_fps = 30.0
+
+# Seeking in inter-coded video isn't frame accurate on every backend, OpenCV
+# 2.4's ffmpeg one can land a few frames out. After seeking the position is
+# read back, and if it isn't the frame asked for the video is read up to it
+# from the beginning with grab() instead. With trust_seek off it always is,
+# for backends that report the position they were asked for wherever they
+# landed.
+trust_seek = True
+
+
+class FrameSource(object):
+
+    # path is a video file, or a directory of frame_%05d.png images. Reading
+    # begins at frame start, and stops after count frames if given.
+    def __init__(self, path, convert=None, start=0, count=None,
+                 size=queue_size):
+        if os.path.isdir(path):
+            path = path + '/frame_%05d.png'
+
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv.CV_CAP_PROP_FPS)
+        self.start = start
+
+        self.convert = convert
+        self.count = count
+        self.frames = Queue.Queue(size)
+        self.spares = Queue.Queue()
+        self.stopped = threading.Event()
+        self.finished = not self.cap.isOpened()
+
+        self.thread = threading.Thread(target=self.decode)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # reader thread: decode frames until the end, or until released
+    def decode(self):
+        if not self.seek(self.start):
+            self.put((False, None))
+            return
+
+        n = 0
+        while self.count is None or n < self.count:
+            try:
+                spare = self.spares.get_nowait()
+            except Queue.Empty:
+                spare = None
+
+            ret, frame = self.cap.read(spare)
+            if ret and self.convert is not None:
+                frame = cv2.cvtColor(frame, self.convert)
+
+            if not ret or not self.put((ret, frame)):
+                break
+            n += 1
+
+        self.put((False, None))
+
+    # move the capture on to frame start, False if the video is shorter
+    def seek(self, start):
+        if start <= 0:
+            return True
+
+        if trust_seek:
+            self.cap.set(cv.CV_CAP_PROP_POS_FRAMES, start)
+            if int(round(self.cap.get(cv.CV_CAP_PROP_POS_FRAMES))) == start:
+                return True
+
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.path)
+
+        for i in xrange(start):
+            if self.stopped.is_set() or not self.cap.grab():
+                return False
+        return True
+
+    # wait for room in the queue, unless the source is released meanwhile
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    # the next frame as (ret, frame), ret is False once they've run out
+    def read(self):
+        if self.finished:
+            return False, None
+
+        ret, frame = self.frames.get()
+        if not ret:
+            self.finished = True
+        return ret, frame
+
+    def isOpened(self):
+        return not self.finished
+
+    # hand back a frame that's no longer needed to be decoded into again
+    def recycle(self, frame):
+        if frame is not None and self.convert is None:
+            self.spares.put(frame)
+
+    def release(self):
+        self.stopped.set()
+        self.thread.join()
+        self.cap.release()
+        self.finished = True
+
+    def __iter__(self):
+        while True:
+            ret, frame = self.read()
+            if not ret:
+                return
+            yield frame
+
+
+# Writes frames to a video file, which is opened at the size of the first one
+class FrameSink(object):
+
+    def __init__(self, path, fps=default_fps, fourcc=None):
+        if not fps > 0:
+            fps = default_fps
+        if fourcc is None:
+            fourcc = cv.CV_FOURCC('m', 'p', '4', 'v')
+
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            h, w = frame.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps,
+                                          (w, h), True)
+            if not self.writer.isOpened():
+                raise IOError("Could not open video for writing: " +
+                              self.path)
+
+        self.writer.write(frame)
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
@@ -4,6 +4,10 @@
 
 Little script to generate X Y Z coordinates for a ball launched into the air.
 
+The flight is worked out by trajectory(), which can be imported without
+plotting or writing anything (the benchmark renders its synthetic clips
+from it).
+
 '''
 
 
@@ -23,36 +27,40 @@ beta = alpha / m
 # Initial position: origin
 z0 = 0.0
 y0 = 0.0
-X0 = 0.0
+x0 = 0.0
 
 # Initial velocity
 v_x0 = 5.0
 v_y0 = 20.0
 v_z0 = 40.0
 
-X = []
-Y = []
-Z = []
-v_x = []
-v_y = []
-v_z = []
-
 # Time steps
 steps = 100
-t_HIT = 2.0 * vy0 / g
-dt = t_HIT / steps
 
-X.append(x0)
-Y.append(y0)
-Z.append(z0)
-v_z.append(v_z0)
-v_y.append(v_y0)
-v_x.append(v_x0)
 
-stop = 0
-for i in range(1, steps + 1):
-    if stop != 1:
-        speed = ((v_z[i - 1] ** 2) + (v_y[i - 1] ** 2) + (v_x[i - 1] ** 2)) ** 0.5
+# X, Y, Z positions of a ball launched from the origin with the given initial
+# velocity, over steps time steps of its flight or until it hits the ground
+def trajectory(v_x0=v_x0, v_y0=v_y0, v_z0=v_z0, steps=steps):
+    X = []
+    Y = []
+    Z = []
+    v_x = []
+    v_y = []
+    v_z = []
+
+    t_HIT = 2.0 * v_y0 / g
+    dt = t_HIT / steps
+
+    X.append(x0)
+    Y.append(y0)
+    Z.append(z0)
+    v_z.append(v_z0)
+    v_y.append(v_y0)
+    v_x.append(v_x0)
+
+    for i in range(1, steps + 1):
+        speed = ((v_z[i - 1] ** 2) + (v_y[i - 1] ** 2) +
+                 (v_x[i - 1] ** 2)) ** 0.5
 
         # First calculate velocity
         v_x.append(v_x[i - 1] * (1.0 - beta * speed * dt))
@@ -60,23 +68,33 @@ for i in range(1, steps + 1):
         v_y.append(v_y[i - 1] + (- g - beta * v_y[i - 1] * speed) * dt)
 
         # Now calculate position
-        X.append(x[i - 1] + v_x[i - 1] * dt)
-        Z.append(z[i - 1] + v_z[i - 1] * dt)
-        Y.append(y[i - 1] + v_y[i - 1] * dt)
+        X.append(X[i - 1] + v_x[i - 1] * dt)
+        Z.append(Z[i - 1] + v_z[i - 1] * dt)
+        Y.append(Y[i - 1] + v_y[i - 1] * dt)
 
         # Stop if hits ground
-        if y[i] <= 0.0:
-            stop = 1
+        if Y[i] <= 0.0:
+            break
+
+    return X, Y, Z
+
+
+def main():
+    X, Y, Z = trajectory()
+
+    # Plot results
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+
+    ax.plot(X, Z, Y, 'b.')
+    plt.show()
 
-# Plot results
-fig = plt.figure()
-ax = fig.add_subplot(111, projection='3d')
+    outfile = open('projectile_data.txt', 'w')
+    for x, y, z in zip(X, Y, Z):
+        outfile.write(str(x) + ' ' + str(y) + ' ' + str(z) + '\n')
 
-ax.plot(x, z, y, 'b.')
-plt.show()
+    outfile.close()
 
-outfile = open('projectile_data.txt', 'w')
-for x, z, y in zip(x, z, y):
-    outfile.write(str(x) + ' ' + str(y) + ' ' + str(z) + '\n')
 
-outfile.close()
+if __name__ == '__main__':
+    main()
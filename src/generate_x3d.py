@@ -5,6 +5,7 @@ import os.path
 from yattag import Doc
 from yattag import indent
 import sys
+import records
 
 ''' generate_x3d.py
 
@@ -24,21 +25,14 @@ doc, tag, text = Doc().tagtext()
 
 # Input the clip directory
 clip = sys.argv[1]
-source_data = os.path.join(clip, '3d_out.txt')
+source_data = records.path(os.path.join(clip, '3d_out'))
 html_target = os.path.join(clip, 'graphs/3d.xhtml')
 
 template_file = open('x3d/template.xhtml', 'r')
 template = template_file.readlines()
 template_file.close()
 
-with open(source_data) as datafile:
-    data3d = datafile.read()
-    datafile.close()
-
-# Gobble blanks at EOF if there
-data = data3d.split('\n')
-if data[-1] in ['\n', '\r\n', '']:
-    data.pop(-1)
+data = records.load(source_data, records.POINT3D).tolist()
 
 # Pop off the goalposts - we don't need them later
 bl = data.pop(0)
@@ -46,10 +40,10 @@ tl = data.pop(0)
 tr = data.pop(0)
 br = data.pop(0)
 
-bl_z = float(bl.split()[2])
-tl_z = float(tl.split()[2])
-tr_z = float(tr.split()[2])
-br_z = float(br.split()[2])
+bl_z = bl[2]
+tl_z = tl[2]
+tr_z = tr[2]
+br_z = br[2]
 
 # Work out ditance to goal so we know how to displace traj from origin
 depth = (bl_z + tl_z + tr_z + br_z) / 4
@@ -68,9 +62,9 @@ with tag('transform', translation=shift_string):
                 doc.stag('material', diffuseColor='0 0 1')
 
     for row in data:
-        x = row.split()[0]
-        y = row.split()[1]
-        z = row.split()[2]
+        x = str(row[0])
+        y = str(row[1])
+        z = str(row[2])
         coords = x + ' ' + z + ' ' + y
         with tag('transform', translation=coords):
             doc.stag('group', USE='ball')
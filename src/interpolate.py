@@ -12,6 +12,10 @@ arg2 = frame rate, float.
 *arg3* = optional outfilename
 *arg4* = optional 'suppress' of graphics
 
+either file can be .npy, in the binary format of records.py
+
+interpolateTrajectory can also be imported and run on trajectory records.
+
 '''
 
 import sys
@@ -20,61 +24,14 @@ import cv2.cv as cv
 import numpy as np
 import matplotlib.pyplot as plt
 import os.path
-
-try:
-    filename = sys.argv[1]
-    frame_rate = float(sys.argv[2])
-except IndexError:
-    print "Usage: ./interpolate <file> <framerate>"
-    sys.exit()
-
-try:
-    outfilename = sys.argv[3]
-except IndexError:
-    name, ext = os.path.splitext(filename)
-    outfilename = name + "_interpolated.txt"
+import records
 
 # default to showing the detection streams
 view = True
-try:
-    if sys.argv[4] == 'suppress':
-        view = False
-except IndexError:
-    pass
-
-# if the user thinks the camera is 24fps, correct it slightly
-if abs(frame_rate - 24) < 0.01:
-    frame_rate = 23.976
-
-frame_length_ms = float(1000) / float(frame_rate)
-
-# no two points should be further apart in time than 17ms after interpolation
-max_ms_diff = float(frame_length_ms / 2)
-
-print "Frame Rate:", frame_rate
-print "Length of each frame (ms):", frame_length_ms
-
-# data in format: x / y / frame / pid
-with open(filename) as datafile:
-    data = datafile.read()
-    datafile.close()
-data = data.split('\n')
-
-# Gobble blanks at EOF if there
-if data[-1] in ['\n', '\r\n', '']:
-    data.pop(-1)
 
 points = []
 interpolated_points = []
 
-# rows are X, Y, FRAME
-for row in data:
-    point = []
-    point.append(float(row.split(' ')[0]))
-    point.append(float(row.split(' ')[1]))
-    point.append(int(row.split(' ')[2]))
-    points.append(point)
-
 
 # fit the curve segment with 5th degree polynomial
 def fit(a, b):
@@ -134,64 +91,136 @@ def interpolate(start, end, func):
         plt.show()
 
 
-# FIRST: Find any bounces in the trajectory
-arr = np.array(points)
-x = arr[:, 0]
-y = arr[:, 1]
+# Interpolate trajectory records (x, y, frame) shot at frame_rate, returns
+# the list of interpolated [x, y, frame] points
+def interpolateTrajectory(data, frame_rate):
+    global points
+    global interpolated_points
+    global frame_length_ms
+    global max_ms_diff
+    global seg_x
+    global seg_y
 
-bounc_i = []
-for i, ay in enumerate(y):
+    # if the user thinks the camera is 24fps, correct it slightly
+    if abs(frame_rate - 24) < 0.01:
+        frame_rate = 23.976
 
-    if i == 0:
-        prev = -1000
-    else:
-        prev = y[i - 1]
+    frame_length_ms = float(1000) / float(frame_rate)
 
-    try:
-        nex = y[i + 1]
-    except IndexError:
-        nex = -1000
+    # no two points should be further apart in time than 17ms after
+    # interpolation
+    max_ms_diff = float(frame_length_ms / 2)
+
+    print "Frame Rate:", frame_rate
+    print "Length of each frame (ms):", frame_length_ms
+
+    interpolated_points = []
+
+    # rows are X, Y, FRAME
+    points = [[x, y, f] for x, y, f in
+              zip(data['x'].tolist(), data['y'].tolist(),
+                  data['frame'].tolist())]
+
+    # FIRST: Find any bounces in the trajectory
+    arr = np.array(points)
+    x = arr[:, 0]
+    y = arr[:, 1]
+
+    bounc_i = []
+    for i, ay in enumerate(y):
 
-    if ay < prev and ay < nex:
-        ax = x[i]
-        bounc_i.append(i)
+        if i == 0:
+            prev = -1000
+        else:
+            prev = y[i - 1]
 
-# Split trajectory at the bounces and interpolate each segment individually
-root = 0
+        try:
+            nex = y[i + 1]
+        except IndexError:
+            nex = -1000
 
-# for each bounce
-for count, i in enumerate(bounc_i):
+        if ay < prev and ay < nex:
+            ax = x[i]
+            bounc_i.append(i)
 
-    # get the segment
-    seg_x = x[root:i + 1]
-    seg_y = y[root:i + 1]
+    # Split trajectory at the bounces and interpolate each segment
+    # individually
+    root = 0
+
+    # for each bounce
+    for count, i in enumerate(bounc_i):
+
+        # get the segment
+        seg_x = x[root:i + 1]
+        seg_y = y[root:i + 1]
+
+        # fit it
+        f = fit(seg_x, seg_y)
+
+        # interpolate the original data between along the segment
+        interpolate(root, i, f)
+
+        root = i
+
+    # corner case: no bounces / last bounce
+    seg_x = x[root:]
+    seg_y = y[root:]
 
-    # fit it
     f = fit(seg_x, seg_y)
+    interpolate(root, len(x) - 1, f)
+
+    return interpolated_points
+
+
+# write the interpolated points out as: X / Y / FRAME / 1
+def writeInterpolated(interpolated_points, outfilename):
+    if records.binary(outfilename):
+        rows = [(p[0], p[1], p[2], 1) for p in interpolated_points]
+        records.save(outfilename, records.pack(rows, records.DETECTION))
+        return
+
+    outfile = open(outfilename, 'w')
+    startOfFile = True
 
-    # interpolate the original data between along the segment
-    interpolate(root, i, f)
+    for p in interpolated_points:
+        if not startOfFile:
+            outfile.write('\n')
 
-    root = i
+        p_string = str(p[0]) + ' ' + str(p[1]) + ' ' + str(p[2]) + ' ' + '1'
+        outfile.write(p_string)
+        startOfFile = False
 
-# corner case: no bounces / last bounce
-seg_x = x[root:]
-seg_y = y[root:]
+    outfile.close()
 
-f = fit(seg_x, seg_y)
-interpolate(root, len(x) - 1, f)
 
-# write to file
-outfile = open(outfilename, 'w')
-startOfFile = True
+def main():
+    global view
+
+    try:
+        filename = sys.argv[1]
+        frame_rate = float(sys.argv[2])
+    except IndexError:
+        print "Usage: ./interpolate <file> <framerate>"
+        sys.exit()
+
+    try:
+        outfilename = sys.argv[3]
+    except IndexError:
+        name, ext = os.path.splitext(filename)
+        outfilename = name + "_interpolated.txt"
+
+    try:
+        if sys.argv[4] == 'suppress':
+            view = False
+    except IndexError:
+        pass
+
+    # data in format: x / y / frame / pid
+    data = records.load(filename, records.POINT)
 
-for p in interpolated_points:
-    if not startOfFile:
-        outfile.write('\n')
+    writeInterpolated(interpolateTrajectory(data, frame_rate), outfilename)
+    print "> Written to:", outfilename
 
-    p_string = str(p[0]) + ' ' + str(p[1]) + ' ' + str(p[2]) + ' ' + '1'
-    outfile.write(p_string)
-    startOfFile = False
 
-outfile.close()
-print "> Written to:", outfilename
+if __name__ == '__main__':
+    main()
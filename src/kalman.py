@@ -15,13 +15,20 @@ in format: trajectory_id x y frame point_id
 *arg1* = optional infile, otherwise data/data_detections.txt
 *arg2* = optional outfile, otherwise data/data_trajectories.txt
 
+Either file can be .npy, in the binary format of records.py.
+
+The filter (KalmanFilter, a batch of filters in stacked numpy arrays) and
+its helpers (setPostState, predict, correct) can be imported without running
+the segmentation, detect.py's online tracker uses them. segment() runs the
+segmentation on detection records in memory.
+
 '''
 
 import sys
-import cv2
-import cv2.cv as cv
 import numpy as np
+import math
 import plotting as plot
+import records
 import matplotlib.pyplot as plt
 
 # Trajectory generation / verification parameters
@@ -29,6 +36,9 @@ init_dist = 400
 denom = 2.5
 min_v_dist = 6
 
+# Cell size (px) of the per-frame spatial grid used for nearby point lookups
+grid_size = 50
+
 # Kalman covariances and system equation parameters
 Sensor_Cov = 10
 PN_Cov = 4
@@ -36,123 +46,166 @@ horizontal_acc_const = -0.04
 
 # Program markers
 max_frame = 0
-max_length = 0
-new_trajectory = True
-n_miss = 0
 max_misses = 7
 min_length = 8
 
+# skip seeds that would only rebuild part of an already confirmed trajectory
+dedupe = True
+
 # debug mode
 d = False
 graphs = False
-predictions = []
-detections = []
-corrections = []
-
-
-# create a fresh kalman filter object using OpenCV and return it
-def KalmanFilter():
-    kf = cv.CreateKalman(6, 2, 0)
-
-    '''
-    init the prediction/evolution/transition matrix
-    | 1  0  1  0 .5  0 | x  |   | x  + vx  + .5ax |
-    | 0  1  0  1  0 .5 | y  | = | y  + vy  + .5ay |
-    | 0  0  1  0  1  0 | vx |   | vx + ax         |
-    | 0  0  0  1  0  1 | vy |   | vy + ay         |
-    | 0  0  k  0  0  0 | ax |   |   k*vx          |
-    | 0  0  0  0  0  1 | ay |   |    ay           |
-    '''
-
-    # diagonals
-    for j in range(6):
-        for k in range(6):
-            kf.transition_matrix[j, k] = 0
-        kf.transition_matrix[j, j] = 1
+
+
+'''
+init the prediction/evolution/transition matrix
+| 1  0  1  0 .5  0 | x  |   | x  + vx  + .5ax |
+| 0  1  0  1  0 .5 | y  | = | y  + vy  + .5ay |
+| 0  0  1  0  1  0 | vx |   | vx + ax         |
+| 0  0  0  1  0  1 | vy |   | vy + ay         |
+| 0  0  k  0  0  0 | ax |   |   k*vx          |
+| 0  0  0  0  0  1 | ay |   |    ay           |
+'''
+def transition_matrix():
+    A = np.identity(6)
 
     # x + vx + 0.5ax
-    kf.transition_matrix[0, 2] = 1
-    kf.transition_matrix[0, 4] = 0.5
+    A[0, 2] = 1
+    A[0, 4] = 0.5
 
     # y + vy + 0.5ay
-    kf.transition_matrix[1, 3] = 1
-    kf.transition_matrix[1, 5] = 0.5
+    A[1, 3] = 1
+    A[1, 5] = 0.5
 
     # vx + ax
-    kf.transition_matrix[2, 4] = 1
+    A[2, 4] = 1
 
     # vy + ay
-    kf.transition_matrix[3, 5] = 1
+    A[3, 5] = 1
 
     # predict ax = k * vx
-    kf.transition_matrix[4, 4] = 0
-    kf.transition_matrix[4, 2] = horizontal_acc_const
-
-    '''
-    measurement matrix H: mean = H * state
-    | 1 0 | x |   | x |
-    | 0 1 | y | = | y |
-    '''
-    kf.measurement_matrix[0, 0] = 1
-    kf.measurement_matrix[1, 1] = 1
-
-    # process noise cov matrix Q: models the EXTERNAL uncertainty
-    cv.SetIdentity(kf.process_noise_cov, PN_Cov)
-
-    # measurement noise cov matrix R: covariance of SENSOR noise
-    cv.SetIdentity(kf.measurement_noise_cov, Sensor_Cov)
-
-    '''
-    error estimate covariance matrix P: relates the correlation of state vars
-    priori: before measurement
-    posteriori: after measurement
-    diagonals are all 1. x-vy and y-vy also correlated.
-
-    | xx  xy  xvx  xvy  xax  xay  |   | 1 0 1 0 0 0 |
-    | yx  yy  yvx  yvy  yax  yay  |   | 0 1 0 1 0 0 |
-    | vxx vxy vxvx vxvy vxax vxay | = | 1 0 1 0 0 0 |
-    | vyx vyy vyvx vyvy vyax vyay |   | 0 1 0 1 0 0 |
-    | axx axy axvx axvy axax axay |   | 0 0 0 0 1 0 |
-    | ayx ayy ayvx ayvy ayax ayay |   | 0 0 0 0 0 1 |
-    '''
-    cv.SetIdentity(kf.error_cov_post, 1)
-    kf.error_cov_post[0, 2] = 1
-    kf.error_cov_post[1, 3] = 1
-    kf.error_cov_post[2, 0] = 1
-    kf.error_cov_post[3, 1] = 1
-
-    return kf
+    A[4, 4] = 0
+    A[4, 2] = horizontal_acc_const
+
+    return A
+
+
+'''
+error estimate covariance matrix P: relates the correlation of state vars
+priori: before measurement
+posteriori: after measurement
+diagonals are all 1. x-vy and y-vy also correlated.
+
+| xx  xy  xvx  xvy  xax  xay  |   | 1 0 1 0 0 0 |
+| yx  yy  yvx  yvy  yax  yay  |   | 0 1 0 1 0 0 |
+| vxx vxy vxvx vxvy vxax vxay | = | 1 0 1 0 0 0 |
+| vyx vyy vyvx vyvy vyax vyay |   | 0 1 0 1 0 0 |
+| axx axy axvx axvy axax axay |   | 0 0 0 0 1 0 |
+| ayx ayy ayvx ayvy ayax ayay |   | 0 0 0 0 0 1 |
+'''
+def initial_error_cov():
+    P = np.identity(6)
+    P[0, 2] = 1
+    P[1, 3] = 1
+    P[2, 0] = 1
+    P[3, 1] = 1
+    return P
+
+
+''' KalmanFilter
+
+A bank of n constant acceleration kalman filters, one per row of the stacked
+state (n, 6) and covariance (n, 6, 6) arrays. One predict or correct call
+advances any set of rows at once.
+
+Follows the same equations as OpenCV's cvKalmanPredict/cvKalmanCorrect,
+including predict copying the predicted state into state_post.
+
+'''
+class KalmanFilter(object):
+
+    def __init__(self, n=1):
+        self.transition_matrix = transition_matrix()
+
+        '''
+        measurement matrix H: mean = H * state
+        | 1 0 | x |   | x |
+        | 0 1 | y | = | y |
+        '''
+        self.measurement_matrix = np.zeros((2, 6))
+        self.measurement_matrix[0, 0] = 1
+        self.measurement_matrix[1, 1] = 1
+
+        # process noise cov matrix Q: models the EXTERNAL uncertainty
+        self.process_noise_cov = PN_Cov * np.identity(6)
+
+        # measurement noise cov matrix R: covariance of SENSOR noise
+        self.measurement_noise_cov = Sensor_Cov * np.identity(2)
+
+        self.state_pre = np.zeros((n, 6))
+        self.state_post = np.zeros((n, 6))
+        self.error_cov_pre = np.zeros((n, 6, 6))
+        self.error_cov_post = np.tile(initial_error_cov(), (n, 1, 1))
+
+    # predict the given rows (default all) and return their predicted states
+    def predict(self, rows=None):
+        if rows is None:
+            rows = slice(None)
+
+        A = self.transition_matrix
+
+        # x'(k) = A*x(k)
+        pre = np.dot(self.state_post[rows], A.T)
+
+        # P'(k) = A*P(k)*At + Q
+        cov = np.matmul(np.matmul(A, self.error_cov_post[rows]), A.T)
+        cov += self.process_noise_cov
+
+        self.state_pre[rows] = pre
+        self.error_cov_pre[rows] = cov
+
+        # handle the case when there will be measurement before next predict
+        self.state_post[rows] = pre
+        return pre
+
+    # correct the given rows (default all) against (n, 2) measurements and
+    # return their corrected states
+    def correct(self, measurements, rows=None):
+        if rows is None:
+            rows = slice(None)
+
+        H = self.measurement_matrix
+        pre = self.state_pre[rows]
+        cov = self.error_cov_pre[rows]
+
+        # K(k) = P'(k)*Ht*inv(H*P'(k)*Ht + R)
+        PHt = np.matmul(cov, H.T)
+        S = np.matmul(H, PHt) + self.measurement_noise_cov
+        K = np.matmul(PHt, np.linalg.inv(S))
+
+        # x(k) = x'(k) + K(k)*(z(k) - H*x'(k))
+        residual = np.asarray(measurements, dtype=float) - np.dot(pre, H.T)
+        post = pre + np.matmul(K, residual[:, :, np.newaxis])[:, :, 0]
+
+        # P(k) = P'(k) - K(k)*H*P'(k)
+        self.state_post[rows] = post
+        self.error_cov_post[rows] = cov - np.matmul(K, np.matmul(H, cov))
+        return post
 
 
 # Manually set the KF post-state to initalise it
-def setPostState(x, y, vx, vy, ax, ay):
-    global kf
-    kf.state_post[0, 0] = x
-    kf.state_post[1, 0] = y
-    kf.state_post[2, 0] = vx
-    kf.state_post[3, 0] = vy
-    kf.state_post[4, 0] = ax
-    kf.state_post[5, 0] = ay
+def setPostState(kf, x, y, vx, vy, ax, ay, row=0):
+    kf.state_post[row] = (x, y, vx, vy, ax, ay)
 
 
 # kalman filter predict and return it as a tuple
-def predict(kf):
-    predicted = cv.KalmanPredict(kf)
-    return (predicted[0, 0], predicted[1, 0],
-            predicted[2, 0], predicted[3, 0],
-            predicted[4, 0], predicted[5, 0])
+def predict(kf, row=0):
+    return tuple(kf.predict([row])[0])
 
 
 # KF correct and return it as a tuple
-def correct(kf, x, y):
-    global measurement
-    measurement[0, 0] = x
-    measurement[1, 0] = y
-
-    corrected = cv.KalmanCorrect(kf, measurement)
-    return (corrected[0, 0], corrected[1, 0],
-            corrected[2, 0], corrected[3, 0],
-            corrected[4, 0], corrected[5, 0])
+def correct(kf, x, y, row=0):
+    return tuple(kf.correct([(x, y)], [row])[0])
 
 
 # Check if the prediction is verified by a detection in the next frame
@@ -166,11 +219,14 @@ def verified(predicted_point, next_frame_index, v_distance):
     min_sep = v_distance
     vpoint = None
 
-    # for each candidate in the next frame, check the distance between the pair
-    for point_index, point in enumerate(next_frame["x"]):
-        cx = float(next_frame["x"][point_index])
-        cy = float(next_frame["y"][point_index])
-        c_pid = int(next_frame["pid"][point_index])
+    # for each candidate near the prediction, check the distance between the
+    # pair
+    nearby = grid_query(next_frame["grid"], predicted_point[0],
+                        predicted_point[1], v_distance)
+    for point_index in nearby:
+        cx = next_frame["x"][point_index]
+        cy = next_frame["y"][point_index]
+        c_pid = next_frame["pid"][point_index]
         c_frame = next_frame_index
 
         # POINT: X / Y / FRAME / PID
@@ -190,6 +246,44 @@ def verified(predicted_point, next_frame_index, v_distance):
         return False
 
 
+# Bin the points of a frame into a spatial grid: {(col, row): [indices]}
+def build_grid(all_x, all_y):
+    cols = np.floor(np.asarray(all_x, dtype=float) / grid_size).astype(int)
+    rows = np.floor(np.asarray(all_y, dtype=float) / grid_size).astype(int)
+
+    grid = {}
+    for i, cell in enumerate(zip(cols.tolist(), rows.tolist())):
+        grid.setdefault(cell, []).append(i)
+    return grid
+
+
+# Indices of the points in a grid that may be within dist of (x, y), in the
+# same order the points appear in the frame
+def grid_query(grid, x, y, dist):
+    x = float(x)
+    y = float(y)
+    col1 = int(math.floor((x - dist) / grid_size))
+    col2 = int(math.floor((x + dist) / grid_size))
+    row1 = int(math.floor((y - dist) / grid_size))
+    row2 = int(math.floor((y + dist) / grid_size))
+
+    # sparse frames: cheaper to check the occupied cells than the whole range
+    if (col2 - col1 + 1) * (row2 - row1 + 1) > len(grid):
+        cells = [c for c in grid
+                 if col1 <= c[0] <= col2 and row1 <= c[1] <= row2]
+    else:
+        cells = [(col, row) for col in xrange(col1, col2 + 1)
+                 for row in xrange(row1, row2 + 1)]
+
+    indices = []
+    for cell in cells:
+        indices.extend(grid.get(cell, []))
+
+    if len(cells) > 1:
+        indices.sort()
+    return indices
+
+
 # Is distance between point A and point B less than C
 def point_is_near_point(point1, point2, dist):
     x1 = point1[0]
@@ -206,12 +300,13 @@ def point_is_near_point(point1, point2, dist):
         return False, sep
 
 
-''' build_trajectory()
+''' Track
 
-main recursive trajectory generation method.
+State of a single trajectory being followed by its own kalman filter.
 
 given a valid pair of nearby points in sequential frames, initalise the
-kalman filter and try to follow that trajectory forwards in time.
+kalman filter and try to follow that trajectory forwards in time, one frame
+per step(), until too many predictions in a row go unverified.
 
 Current two points are referred to as the HEAD and ARM
 
@@ -219,306 +314,392 @@ o-----o-----o-----o-----o-----x
                   HEAD  ARM   PREDICTED
 
 '''
-def build_trajectory(this_trajectory, bridge, kf, frame_index, p0, p1, real):
-
-    global predictions
-    global detections
-    global corrections
-    global d
-    global new_trajectory
-    global n_miss
-    postState = kf.state_post
-    preState = kf.state_pre
-
-    if d and new_trajectory:
-        print "\nNEW"
-
-    if d:
-        print "\ntrajectory:\n", this_trajectory
-        print "Head:", p0
-        print "Arm:", p1
-        print "Post state:\n", np.asarray(postState[:, :])
-        print "Pre state:\n", np.asarray(preState[:, :])
-
-    # PREDICT location of next point
-    predicted = predict(kf)
-    predictions.append((predicted[0], predicted[1]))
-    if d:
-        print "Predicted:", predicted
-
-    # Set verifying distance to fraction of current speed, or a minumum value
-    v_dist = (((postState[2, 0] ** 2) + (postState[3, 0] ** 2)) ** 0.5) / denom
-    if v_dist < min_v_dist:
-        v_dist = min_v_dist
-
-    # MEASURE location of verifying point
-    p_verification = verified(predicted, frame_index + 1, v_dist)
-
-    if d:
-        print "Verified by:", p_verification
-
-    if p_verification is False:
-        n_miss += 1
-
-        # If we've made too many unverified predictions, give up.
-        if n_miss >= max_misses:
-            if d:
-                print "Bridge too far. End at last verified point."
-            n_miss = 0
-            new_trajectory = True
-            bridge = []
-            predictions = []
-
-        # Otherwise, have another crack
-        else:
-            # keep predicting from the unverified corrected point
-            unverified = (predicted[0], predicted[1], frame_index + 1, 1000)
-            if d:
-                print "Append predicted point to bridge:", unverified
-            bridge.append(unverified)
+class Track(object):
+
+    def __init__(self, kf, frame_index, p0, p1, row=0):
+        self.kf = kf
+        self.row = row
+        self.frame_index = frame_index
+        self.head = p0
+        self.arm = p1
+
+        # is the arm a real detection, or an unverified prediction
+        self.real = True
+
+        self.trajectory = []
+        self.bridge = []
+        self.new_trajectory = True
+        self.n_miss = 0
+        self.alive = True
+
+        # only kept for the debug graphs
+        self.predictions = []
+        self.detections = []
+        self.corrections = []
+
+    # predict the next point, and extend the trajectory if it's verified
+    def step(self):
+        predicted = predict(self.kf, self.row)
+        p_verification = self.advance(predicted)
 
-            if graphs:
-                plt.plot(all_x, all_y, '.')
+        # CORRECT filter against the verifying (but noisy) measurement
+        if p_verification is not None:
+            x = p_verification[0]
+            y = p_verification[1]
+            self.corrected(correct(self.kf, x, y, self.row))
 
-                x = [t[0] for t in this_trajectory]
-                y = [t[1] for t in this_trajectory]
-                plt.plot(x, y, 'r.')
-                plt.plot([p0[0], p1[0]], [p0[1], p1[1]], 'm.')
+    # given this track's predicted state, look for the verifying point.
+    # Returns it if found, for the filter to be corrected against.
+    def advance(self, predicted):
+        if d and self.new_trajectory:
+            print "\nNEW"
 
-                x = [p[0] for p in detections]
-                y = [p[1] for p in detections]
-                plt.plot(x, y, 'r')
+        if d:
+            print "\ntrajectory:\n", self.trajectory
+            print "Head:", self.head
+            print "Arm:", self.arm
+            print "Predicted:", predicted
 
-                x = [p[0] for p in corrections]
-                y = [p[1] for p in corrections]
-                plt.plot(x, y, 'b')
+        if graphs:
+            self.predictions.append((predicted[0], predicted[1]))
 
-                x = [p[0] for p in predictions]
-                y = [p[1] for p in predictions]
+        # Set verifying distance to fraction of current speed, or a minimum
+        v_dist = (((predicted[2] ** 2) + (predicted[3] ** 2)) ** 0.5) / denom
+        if v_dist < min_v_dist:
+            v_dist = min_v_dist
 
-                plt.plot(x, y, 'g.')
-                plt.show()
+        # MEASURE location of verifying point
+        p_verification = verified(predicted, self.frame_index + 1, v_dist)
 
-            # Recursive call from new trajectory
-            this_trajectory = build_trajectory(
-                this_trajectory, bridge, kf, frame_index + 1, p1, unverified, False)
+        if d:
+            print "Verified by:", p_verification
 
-    # PREDICTION WAS VERIFED BY MEASUREMENT
-    else:
-        # CORRECT filter against the verifying (but noisy) measurement
-        x = p_verification[0]
-        y = p_verification[1]
-        corrected = correct(kf, x, y)
-        corrections.append((corrected[0], corrected[1]))
+        if p_verification is False:
+            self.n_miss += 1
 
-        if d:
-            print "Corrected against P_ver:", corrected
+            # If we've made too many unverified predictions, give up.
+            if self.n_miss >= max_misses:
+                if d:
+                    print "Bridge too far. End at last verified point."
+                self.alive = False
+                return None
+
+            # Otherwise, have another crack
+            # keep predicting from the unverified corrected point
+            unverified = (predicted[0], predicted[1],
+                          self.frame_index + 1, 1000)
+            if d:
+                print "Append predicted point to bridge:", unverified
+            self.bridge.append(unverified)
+
+            if graphs:
+                self.plot(self.predictions)
+
+            # Carry on from the unverified point
+            self.head = self.arm
+            self.arm = unverified
+            self.real = False
+            self.frame_index += 1
+            return None
+
+        # PREDICTION WAS VERIFED BY MEASUREMENT
 
         # if a brand new trajectory, add the initialising points too
-        if new_trajectory:
-            this_trajectory.append(p0)
+        if self.new_trajectory:
+            self.trajectory.append(self.head)
             # only append p1 if it was a real point
-            if real:
-                this_trajectory.append(p1)
-            new_trajectory = False
+            if self.real:
+                self.trajectory.append(self.arm)
+            self.new_trajectory = False
 
-        # if a bridge of unverifieds was needed to get here, reset it to zero
-        if len(bridge) != 0:
-            bridge = []
-            n_miss = 0
+        # if a bridge of unverifieds was needed to get here, reset it
+        if len(self.bridge) != 0:
+            self.bridge = []
+            self.n_miss = 0
 
         # add verifying point to trajectory + continue
-        this_trajectory.append(p_verification)
-        detections.append((x, y))
+        self.trajectory.append(p_verification)
+
+        # NEW HEAD AND ARM
+        self.head = self.arm
+        self.arm = p_verification
+        self.real = True
+        self.frame_index += 1
+        return p_verification
+
+    # the filter has been corrected against the last verifying point
+    def corrected(self, corrected):
+        if d:
+            print "Corrected against P_ver:", corrected
 
         if graphs:
-            plt.plot(all_x, all_y, '.')
-            x = [t[0] for t in this_trajectory]
-            y = [t[1] for t in this_trajectory]
-            plt.plot(x, y, 'r.')
-            plt.plot([p0[0], p1[0]], [p0[1], p1[1]], 'm.')
-
-            x = [p[0] for p in detections]
-            y = [p[1] for p in detections]
-            plt.plot(x, y, 'r')
-
-            x = [p[0] for p in corrections]
-            y = [p[1] for p in corrections]
-            plt.plot(x, y, 'b')
-
-            # x = [p[0] for p in predictions]
-            # y = [p[1] for p in predictions]
-            p = predictions[-1]
-            x = p[0]
-            y = p[1]
-            plt.plot(x, y, 'g.')
-            plt.show()
-
-        # RECURSIVE CALL WITH NEW HEAD AND ARM
-        this_trajectory = build_trajectory(this_trajectory, bridge, kf,
-                                           frame_index + 1, p1,
-                                           p_verification,
-                                           True)
-        detections = []
-        predictions = []
-        corrections = []
-    return this_trajectory
-
-
-# retrieve output of detection system and parse it
+            self.detections.append(self.arm[:2])
+            self.corrections.append((corrected[0], corrected[1]))
+            self.plot(self.predictions[-1:])
+
+    # debug graph of the trajectory so far over all of the detections
+    def plot(self, predictions):
+        plt.plot(all_x, all_y, '.')
+
+        x = [t[0] for t in self.trajectory]
+        y = [t[1] for t in self.trajectory]
+        plt.plot(x, y, 'r.')
+        plt.plot([self.head[0], self.arm[0]], [self.head[1], self.arm[1]],
+                 'm.')
+
+        x = [p[0] for p in self.detections]
+        y = [p[1] for p in self.detections]
+        plt.plot(x, y, 'r')
+
+        x = [p[0] for p in self.corrections]
+        y = [p[1] for p in self.corrections]
+        plt.plot(x, y, 'b')
+
+        x = [p[0] for p in predictions]
+        y = [p[1] for p in predictions]
+        plt.plot(x, y, 'g.')
+        plt.show()
+
+
+# Follow a single trajectory from a pair of points until it ends
+def build_trajectory(kf, frame_index, p0, p1):
+    track = Track(kf, frame_index, p0, p1)
+    while track.alive:
+        track.step()
+    return track.trajectory
+
+
+# Advance a set of tracks sharing one filter bank together, a frame per step,
+# until they all end. Each step is a single predict and a single correct
+# over every live track.
+def follow(kf, tracks):
+    while len(tracks) != 0:
+        rows = [t.row for t in tracks]
+        predicted = kf.predict(rows)
+
+        verifying = []
+        for track, p in zip(tracks, predicted):
+            point = track.advance(p)
+            if point is not None:
+                verifying.append(track)
+
+        if len(verifying) != 0:
+            rows = [t.row for t in verifying]
+            points = [t.arm[:2] for t in verifying]
+            for track, c in zip(verifying, kf.correct(points, rows)):
+                track.corrected(c)
+
+        tracks = [t for t in tracks if t.alive]
+
+
+# Record each consecutive pair of real points in a confirmed trajectory.
+# A seed from one of these pairs would only rebuild a suffix of it.
+def claim(claimed, trajectory):
+    for p, q in zip(trajectory, trajectory[1:]):
+        if q[2] == p[2] + 1 and p[3] != 1000 and q[3] != 1000:
+            claimed[p[3]] = q[3]
+
+
+# split detection records into columns, sorted by frame: x, y, frame and pid
+# arrays, plus the offset index where frame f's detections are rows
+# offsets[f]:offsets[f + 1]
+def columns(data):
+    # keep the file order of the detections within each frame
+    order = np.argsort(data["frame"], kind='mergesort')
+    data = data[order]
+
+    x = data["x"]
+    y = data["y"]
+    frames = data["frame"]
+    pid = data["pid"]
+
+    offsets = np.searchsorted(frames, np.arange(frames[-1] + 2))
+    return x, y, frames, pid, offsets
+
+
+# retrieve output of detection system and split it by frame
 def get_data(filename):
-    global max_frame
-
-    with open(filename) as datafile:
-        data = datafile.read()
-        datafile.close()
+    return frame_data(records.load(filename, records.DETECTION))
 
-    data = data.split('\n')
 
-    # Gobble blank at EOF if exists
-    if data[-1] in ['\n', '\r\n', '']:
-        data.pop(-1)
+# split detection records by frame
+def frame_data(data):
+    global max_frame
 
-    # data_detections in form: X / Y / FRAME / PID
-    all_x = [row.split()[0] for row in data]
-    all_y = [row.split()[1] for row in data]
-    all_frames = [row.split()[2] for row in data]
-    all_pid = [row.split()[3] for row in data]
+    all_x, all_y, all_frames, all_pid, offsets = columns(data)
 
     # now translate into 'frame_array' structure
     # each element of array represents a frame, and holds all the detections
-    # in that particular frame
+    # in that particular frame as plain floats/ints, parsed once
     max_frame = int(all_frames[-1])
     frame_array = [{} for x in xrange(max_frame + 1)]
 
-    # create an array of dictionaries, one element for each frame
-    for i in range(0, max_frame + 1):
-        frame_array[i]["x"] = []
-        frame_array[i]["y"] = []
-        frame_array[i]["pid"] = []
+    x = all_x.tolist()
+    y = all_y.tolist()
+    pid = all_pid.tolist()
+    offsets = offsets.tolist()
 
-    # for each detection, get x/y/pid and dump it into the appropriate dict
-    for row in data:
-        x = row.split()[0]
-        y = row.split()[1]
-        f = int(row.split()[2])
-        p_id = row.split()[3]
+    for f, frame in enumerate(frame_array):
+        start = offsets[f]
+        end = offsets[f + 1]
+        frame["x"] = x[start:end]
+        frame["y"] = y[start:end]
+        frame["pid"] = pid[start:end]
 
-        frame_array[f]["x"].append(x)
-        frame_array[f]["y"].append(y)
-        frame_array[f]["pid"].append(p_id)
+        # index each frame's points spatially for the nearby point lookups
+        frame["grid"] = build_grid(all_x[start:end], all_y[start:end])
 
     return frame_array, all_x, all_y
 
 
+# write: TID / X / Y / FRAME / PID
+def writeTrajectories(rows, filename):
+    if records.binary(filename):
+        records.save(filename, records.pack(rows, records.TRAJECTORY))
+        return
+
+    outfile = open(filename, 'w')
+    for r in rows:
+        outfile.write(str(r[0]) + " " + str(r[1]) + " " + str(r[2]) + " " +
+                      str(r[3]) + " " + str(r[4]) + "\n")
+    outfile.close()
+
+
 '''
 -------------------------------------------------------------------------------
 -------------------------Main program begins here------------------------------
 -------------------------------------------------------------------------------
 '''
 
-print "----------KALMAN.PY------------"
 
-try:
-    infilename = sys.argv[1]
-    print "Getting detections:", infilename
-except IndexError:
-    infilename = 'data/data_detections.txt'
+# Segment detection records into candidate trajectories, returns rows of
+# TID / X / Y / FRAME / PID for those longer than min_length
+def segment(data):
+    global frame_array
+    global all_x
+    global all_y
 
-try:
-    outfilename = sys.argv[2]
-except IndexError:
-    outfilename = 'data/data_trajectories.txt'
+    frame_array, all_x, all_y = frame_data(data)
 
-frame_array, all_x, all_y = get_data(infilename)
-outfile = open(outfilename, 'w')
-trajectories = []
+    # every trajectory, in the order the tracks were seeded
+    trajectories = []
 
-# Initialise the state/measurement/prediction/correction for KF
-state = cv.CreateMat(6, 1, cv.CV_32FC1)
-measurement = cv.CreateMat(2, 1, cv.CV_32FC1)
-predicted = None
-corrected = None
+    # point pairs already followed by a confirmed trajectory: PID -> next PID
+    claimed = {}
+    skipped = 0
 
-# FOR each frame F0:
-for frame_index, f0 in enumerate(frame_array):
+    # FOR each frame F0:
+    for frame_index, f0 in enumerate(frame_array):
 
-    # always need two frames of headroom to avoid indexError
-    if frame_index == max_frame - 1:
-        break
+        # always need two frames of headroom to avoid indexError
+        if frame_index == max_frame - 1:
+            break
 
-    f1 = frame_array[frame_index + 1]
-    f2 = frame_array[frame_index + 2]
+        f1 = frame_array[frame_index + 1]
+        seeds = []
 
-    # FOR each point b in F0:
-    for b0_index, b0 in enumerate(f0["x"]):
+        # FOR each point b in F0:
+        for b0_index, b0 in enumerate(f0["x"]):
 
-        b0_frame = frame_index
-        b0_x = float(f0["x"][b0_index])
-        b0_y = float(f0["y"][b0_index])
-        b0_pid = int(f0["pid"][b0_index])
+            b0_frame = frame_index
+            b0_x = f0["x"][b0_index]
+            b0_y = f0["y"][b0_index]
+            b0_pid = f0["pid"][b0_index]
 
-        # POINT: X / Y / FRAME / PID
-        b0 = (b0_x, b0_y, b0_frame, b0_pid)
+            # POINT: X / Y / FRAME / PID
+            b0 = (b0_x, b0_y, b0_frame, b0_pid)
 
-        # FOR each point pair of b and b1:
-        for b1_index, b1 in enumerate(f1["x"]):
+            # FOR each point pair of b and a nearby b1:
+            for b1_index in grid_query(f1["grid"], b0_x, b0_y, init_dist):
 
-            b1_frame = frame_index + 1
-            b1_x = float(f1["x"][b1_index])
-            b1_y = float(f1["y"][b1_index])
-            b1_pid = int(f1["pid"][b1_index])
+                b1_frame = frame_index + 1
+                b1_x = f1["x"][b1_index]
+                b1_y = f1["y"][b1_index]
+                b1_pid = f1["pid"][b1_index]
 
-            # POINT: X / Y / FRAME / PID
-            b1 = (b1_x, b1_y, b1_frame, b1_pid)
+                # POINT: X / Y / FRAME / PID
+                b1 = (b1_x, b1_y, b1_frame, b1_pid)
 
-            # IF separation between b and b+ is small
-            xdiff = b1_x - b0_x
-            ydiff = b1_y - b0_y
-            sep = ((ydiff ** 2) + (xdiff ** 2)) ** 0.5
+                # already followed this pair as part of a longer trajectory
+                if dedupe and claimed.get(b0_pid) == b1_pid:
+                    skipped += 1
+                    continue
 
-            # If two points are closer than the initisation distance
-            if sep < init_dist:
+                # IF separation between b and b+ is small
+                xdiff = b1_x - b0_x
+                ydiff = b1_y - b0_y
+                sep = ((ydiff ** 2) + (xdiff ** 2)) ** 0.5
 
-                # init new kalman filter and try to build a single trajectory
-                kf = KalmanFilter()
-                vx = xdiff
-                vy = ydiff
+                # If two points are closer than the initisation distance
+                if sep < init_dist:
+                    seeds.append((b0, b1, xdiff, ydiff))
 
-                if d:
-                    print "\n-------- INIT Filter --------"
-                    print "Points:", b0, b1
+        # one bank of filters, one row per seed, to follow each trajectory
+        kf = KalmanFilter(len(seeds))
+        tracks = []
+        for row, (b0, b1, vx, vy) in enumerate(seeds):
 
-                # Manually initialise state with guess at speed as well
-                setPostState(b1[0], b1[1], vx, vy, 0, 0)
-                if d:
-                    print "Post state set:", b1[0], b1[1], vx, vy, 0, 0
+            if d:
+                print "\n-------- INIT Filter --------"
+                print "Points:", b0, b1
 
-                this_t = []
-                bridge = []
-                trajectory = build_trajectory(
-                    this_t, bridge, kf, frame_index + 1, b0, b1, True)
+            # Manually initialise state with guess at speed as well
+            setPostState(kf, b1[0], b1[1], vx, vy, 0, 0, row)
+            if d:
+                print "Post state set:", b1[0], b1[1], vx, vy, 0, 0
 
-                if len(trajectory) != 0:
-                    trajectories.append(trajectory)
-                    if len(trajectory) > max_length:
-                        max_length = len(trajectory)
+            tracks.append(Track(kf, frame_index + 1, b0, b1, row))
 
-print ""
-count = 0
-ti = 0
+        # follow all of this frame's seeds together to their ends
+        follow(kf, tracks)
 
-# write: TID / X / Y / FRAME / PID
-for ti, trajectory in enumerate(trajectories):
-    if len(trajectory) > min_length:
-        count += 1
-        for p in trajectory:
-            outfile.write(str(count) + " " + str(p[0]) + " " +
-                          str(p[1]) + " " + str(p[2]) + " " + str(p[3]) + "\n")
-
-print "> Found", ti, "trajectories"
-print ">", count, "are longer than", min_length, "points"
-print "> Most Detections:", max_length
-print "> written to: ", outfilename
-
-outfile.close()
+        for track in tracks:
+            if len(track.trajectory) != 0:
+                trajectories.append(track.trajectory)
+            if dedupe and len(track.trajectory) > min_length:
+                claim(claimed, track.trajectory)
+
+    max_length = max([0] + [len(t) for t in trajectories])
+
+    print ""
+    count = 0
+    ti = 0
+    rows = []
+
+    # TID / X / Y / FRAME / PID
+    for ti, trajectory in enumerate(trajectories):
+        if len(trajectory) > min_length:
+            count += 1
+            for p in trajectory:
+                rows.append((count,) + tuple(p))
+
+    print "> Found", ti, "trajectories"
+    print ">", count, "are longer than", min_length, "points"
+    if dedupe:
+        print "> Skipped", skipped, "seeds on confirmed trajectories"
+    print "> Most Detections:", max_length
+
+    return rows
+
+
+def main():
+    print "----------KALMAN.PY------------"
+
+    try:
+        infilename = sys.argv[1]
+        print "Getting detections:", infilename
+    except IndexError:
+        infilename = 'data/data_detections.txt'
+
+    try:
+        outfilename = sys.argv[2]
+    except IndexError:
+        outfilename = 'data/data_trajectories.txt'
+
+    rows = segment(records.load(infilename, records.DETECTION))
+    writeTrajectories(rows, outfilename)
+    print "> written to: ", outfilename
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/local/bin/python
+
+''' kicks.py
+
+Split the recordings of a whole session into one clip per free kick.
+
+Each camera's recording is scanned once for its motion energy (activity.py),
+the two at the same time. The active segments of camera 1 are the candidate
+kicks, and the detector is run over them on a pool of workers
+(detect.detectRange), decoding just the active frames. A segment is only a
+kick if the ball is detected in at least min_frames of its frames, and the
+clip is cut to the detections with pad frames either side. The cameras don't
+start recording together, so camera 2's clips are shifted by the offset
+between the two recordings' motion energies.
+
+The clips are written as videos laid out the way batch.py expects,
+
+    <videos>/<session>/kick_<first frame>/video1.avi
+    <videos>/<session>/kick_<first frame>/video2.avi
+
+and then, if the session's scene data exists, analysed in parallel by
+batch.py. A clip cut again replaces the old one. Kicks left in the session
+from an earlier cut that this one didn't find (eg. with other settings) are
+flagged, or deleted with 'replace'.
+
+arg1 = session name
+arg2 = recording from camera 1
+arg3 = recording from camera 2
+*arg4* = directory to cut the clips into, otherwise videos
+*arg5* = number of worker processes, 0 to only cut the clips
+*arg6* = 'replace' to delete kicks from earlier cuts that weren't found again
+
+'''
+
+import sys
+import os
+import glob
+import shutil
+import multiprocessing
+import numpy as np
+import activity
+import detect
+import frames
+import batch
+import pipeline
+
+# frames of a segment the ball has to be detected in for it to be a kick
+min_frames = 10
+
+# frames kept either side of the first and last detections
+pad = 15
+
+
+# Offset of recording 2 from recording 1, in frames, from where their motion
+# energies line up best: frame f of camera 1 is frame f + offset of camera 2
+def offset(energy1, energy2):
+    size = 1
+    while size < len(energy1) + len(energy2):
+        size *= 2
+
+    e1 = np.fft.rfft(energy1 - energy1.mean(), size)
+    e2 = np.fft.rfft(energy2 - energy2.mean(), size)
+    correlation = np.fft.irfft(e1 * np.conj(e2), size)
+
+    k = int(np.argmax(correlation))
+    if k > size / 2:
+        k -= size
+    return -k
+
+
+# The kicks (start, end) in camera 1's frames among its active segments,
+# each cut down to the frames around its detections. The segments are
+# searched on a pool of workers, or in this process with fewer than two.
+def kicks(path, segments, length, workers=1):
+    jobs = [(path, start, end, {}) for start, end in segments]
+    if workers < 2 or len(jobs) < 2:
+        results = map(detect.detectRange, jobs)
+    else:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        try:
+            results = pool.map(detect.detectRange, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    found = []
+    for (start, end), detections in zip(segments, results):
+        seen = sorted(set(d[2] for d in detections))
+
+        if len(seen) < min_frames:
+            print "> Segment", start, "-", end, "has only", len(seen), \
+                "frames with detections, skipping"
+            continue
+
+        found.append((max(seen[0] - pad, 0),
+                      min(seen[-1] + pad + 1, length)))
+
+    return found
+
+
+# Write frames start to end-1 of a recording out to a video
+def writeVideo(path, start, end, outfile):
+    source = frames.FrameSource(path, start=start, count=end - start)
+    sink = frames.FrameSink(outfile, source.fps)
+    for frame in source:
+        sink.write(frame)
+    source.release()
+    sink.release()
+
+
+# Write a clip's two videos, each (recording, start, end), to clip_dir,
+# replacing the clip if it's already there. The clip only appears once both
+# videos are complete, a clip that fails part way leaves nothing behind.
+def writeClip(clip_dir, videos):
+    partial = clip_dir + '.part'
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    os.makedirs(partial)
+
+    try:
+        for n, (path, start, end) in enumerate(videos):
+            writeVideo(path, start, end,
+                       os.path.join(partial, 'video' + str(n + 1) + '.avi'))
+
+        if os.path.exists(clip_dir):
+            shutil.rmtree(clip_dir)
+        os.rename(partial, clip_dir)
+    finally:
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+
+
+# Cut a session's recordings into clips under root, returning their names.
+# Kicks from earlier cuts that weren't found again are flagged, or deleted
+# if replace is on.
+def cut(session, rec1, rec2, root, workers=1, replace=False):
+    print "> Scanning the recordings for motion..."
+    energy1, energy2 = pipeline.runParallel(activity.energy, [rec1, rec2])
+
+    shift = offset(energy1, energy2)
+    print "> Camera 2's frames are offset by", shift
+
+    segments = activity.segments(energy1)
+    print "> Checking", len(segments), "active segments for kicks..."
+    found = kicks(rec1, segments, len(energy1), workers)
+
+    names = []
+    for start, end in found:
+        # camera 2's frames, kept within its recording
+        start2 = max(start + shift, 0)
+        end2 = min(end + shift, len(energy2))
+        if end2 - start2 < min_frames:
+            print "WARN: Kick at", start, "isn't in camera 2's recording"
+            continue
+
+        name = 'kick_%06d' % start
+        writeClip(os.path.join(root, session, name),
+                  [(rec1, start, end), (rec2, start2, end2)])
+
+        print "> Cut", name + ":", "frames", start, "-", end, \
+            "and", start2, "-", end2
+        names.append(name)
+
+    for clip_dir in sorted(glob.glob(os.path.join(root, session, 'kick_*'))):
+        name = os.path.basename(clip_dir)
+        if name in names or name.endswith('.part') or \
+                not os.path.isdir(clip_dir):
+            continue
+
+        if replace:
+            print "> Deleting", name, "from an earlier cut"
+            shutil.rmtree(clip_dir)
+        else:
+            print "WARN:", name, "is from an earlier cut and wasn't found" + \
+                " again, 'replace' deletes it"
+
+    return names
+
+
+def main():
+    if len(sys.argv) < 4:
+        print "Usage : ./kicks.py <session> <recording1> <recording2>" + \
+            " *<videos>* *<workers>* *replace*"
+        sys.exit(0)
+
+    session, rec1, rec2 = sys.argv[1:4]
+
+    try:
+        root = sys.argv[4]
+    except IndexError:
+        root = 'videos'
+
+    try:
+        workers = int(sys.argv[5])
+    except IndexError:
+        workers = multiprocessing.cpu_count()
+
+    replace = False
+    try:
+        if sys.argv[6] == 'replace':
+            replace = True
+    except IndexError:
+        pass
+
+    names = cut(session, rec1, rec2, root, max(workers, 1), replace)
+    print "> Found", len(names), "kicks"
+
+    if workers == 0 or len(names) == 0:
+        return
+
+    clips = [c for c in batch.discover(root)
+             if c[0] == session and c[1] in names]
+    if len(clips) == 0:
+        return
+
+    print "> Queued", len(clips), "clips on", workers, "workers"
+    batch.run(clips, workers)
+
+
+if __name__ == '__main__':
+    main()
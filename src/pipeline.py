@@ -0,0 +1,518 @@
+#!/usr/local/bin/python
+
+''' pipeline.py
+
+Run the analysis of a session and clip end to end in a single process.
+
+detect -> kalman -> trajectories -> interpolate run in memory for each camera,
+passing records (see records.py) from one stage to the next. calibrate,
+postPoints, manualMatch, reconstruct and the views are run as scripts inside
+this process, so the interpreter and the cv2/numpy/matplotlib imports are
+only paid for once.
+
+The two cameras' branches are independent until reconstruct, so unless the
+stages are being viewed they run at the same time in a process pool.
+
+Each camera's stage outputs are checkpointed into the clip directory as .npy
+(detections, trajectories, trajectory) when checkpoint is on. trajectory1/2
+are always written, reconstruct reads them from there.
+
+Every stage output has a <output>.key next to it, a hash of the stage's
+parameters, its source code and the keys of its inputs. With the cache on
+(the default) a stage is skipped when its key is unchanged, so changing eg.
+kalman's min_length or kalman.py re-runs kalman and everything after it but
+reuses the detections.
+
+Each stage is timed, along with its memory and what it counted (see
+profiling.py). run() writes the profile of the clip to its
+stats/profile.json.
+
+arg1 = session name
+arg2 = clip name
+arg3 = free kick video / image sequence 1
+arg4 = free kick video / image sequence 2
+*arg5* = calibration video 1, needed to create a new session
+*arg6* = calibration video 2, needed to create a new session
+
+'''
+
+import sys
+import os
+import runpy
+import glob
+import hashlib
+import multiprocessing
+import matplotlib.pyplot as plt
+import records
+import detect
+import kalman
+import trajectories
+import interpolate
+import profiling
+
+# frame rate the trajectories are interpolated to
+frame_rate = 30
+
+src = os.path.dirname(os.path.abspath(__file__))
+
+# the session files reconstruct reads
+scene_files = ['camera1.txt', 'camera2.txt', 'statics1.txt', 'statics2.txt',
+               'postPts1.txt', 'postPts2.txt', '3d.txt']
+
+
+# default progress report, squawkFly passes its status label instead
+def report(message):
+    print ">", message
+
+
+def sessionPath(session):
+    return os.path.join('sessions', session)
+
+
+# reconstruct treats these sessions as simulations, without any goalposts
+def simulation(session):
+    return 'simulation' in session or session == 'errors'
+
+
+# The scene files a session can't be reconstructed without: all of them but
+# the 3D ground truth, and the goalposts too for a simulation
+def requiredSceneFiles(session):
+    optional = ['3d.txt']
+    if simulation(session):
+        optional += ['postPts1.txt', 'postPts2.txt']
+    return [f for f in scene_files if f not in optional]
+
+
+def clipPath(session, clip):
+    return os.path.join('sessions', session, clip)
+
+
+# checkpoint file of a camera's stage output, eg. detections1.npy
+def stageFile(p_clip, stem, n):
+    return os.path.join(p_clip, stem + str(n) + '.npy')
+
+
+# Run one of the stage scripts in this process, as if from the command line.
+# Returns whether it ran to the end, a script that stops with a bare
+# sys.exit() or a non-zero code hasn't.
+def runScript(script, *args):
+    argv = sys.argv
+    sys.argv = [script] + [str(a) for a in args]
+    try:
+        runpy.run_path(os.path.join(src, script), run_name='__main__')
+    except SystemExit as e:
+        return e.code == 0
+    finally:
+        sys.argv = argv
+        plt.close('all')
+    return True
+
+
+# Run a stage script that writes outfile, deleting what an earlier run left
+# there first. Returns whether the script ran to the end and wrote it, so
+# output that wasn't made this time is never keyed.
+def runStage(outfile, script, *args):
+    if os.path.exists(outfile):
+        os.remove(outfile)
+    return runScript(script, *args) and os.path.exists(outfile)
+
+
+# Run one of the views, reporting a failure through status instead of raising
+# it, so one broken view doesn't stop the rest being made (the views used to
+# be separate processes). A view that returns False stopped early, see
+# runScript. Returns whether it succeeded.
+def attempt(status, name, view, *args):
+    try:
+        if view(*args) is False:
+            status('Could not make ' + name + ': it stopped early')
+            return False
+        return True
+    except Exception as e:
+        status('Could not make ' + name + ': ' + repr(e))
+        return False
+
+
+# New session: create the scene data
+def scene(session, cal1, cal2, vid1, vid2, view='suppress', status=report,
+          profile=None):
+    if profile is None:
+        profile = profiling.Profile()
+
+    p_session = sessionPath(session)
+    if not os.path.exists(p_session):
+        os.makedirs(p_session)
+
+    status('Calibrating...')
+    with profile.stage('calibrate', camera=1):
+        runScript('calibrate.py', cal1, p_session + '/camera1.txt', view)
+    with profile.stage('calibrate', camera=2):
+        runScript('calibrate.py', cal2, p_session + '/camera2.txt', view)
+
+    status('Matching goalposts...')
+    with profile.stage('postPoints', camera=1):
+        runScript('postPoints.py', vid1, p_session + '/postPts1.txt',
+                  p_session + '/image1.png')
+    with profile.stage('postPoints', camera=2):
+        runScript('postPoints.py', vid2, p_session + '/postPts2.txt',
+                  p_session + '/image2.png')
+
+    status('Matching scene points...')
+    with profile.stage('manualMatch'):
+        runScript('manualMatch.py', vid1, vid2, p_session + '/statics1.txt',
+                  p_session + '/statics2.txt')
+
+
+# Hash of a stage: its name, its parameters and the keys of its inputs. Kept
+# next to the stage's output (<output>.key), a stage whose key hasn't
+# changed doesn't need running again.
+def stageKey(stage, params, *inputs):
+    return hashlib.sha1(repr((stage, sorted(params.items()), inputs)))\
+        .hexdigest()
+
+
+# Key of a video file or image sequence folder: its path, size and time
+def videoKey(path):
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, '*')))
+    else:
+        files = [path]
+
+    stats = [(f, os.path.getsize(f), os.path.getmtime(f)) for f in files]
+    return stageKey('video', {}, *stats)
+
+
+# Key of a set of files from their contents, missing files included
+def fileKey(*paths):
+    contents = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as datafile:
+                contents.append(hashlib.sha1(datafile.read()).hexdigest())
+        except IOError:
+            contents.append(None)
+    return stageKey('files', {}, *contents)
+
+
+# Key of the source of a stage, the modules it runs from this directory. The
+# constants inside them are part of the stage as much as its parameters are.
+def sourceKey(*modules):
+    return fileKey(*[os.path.join(src, m) for m in modules])
+
+
+def readKey(filename):
+    try:
+        with open(filename + '.key') as keyfile:
+            return keyfile.read()
+    except IOError:
+        return None
+
+
+# Record that filename was made by the stage with this key
+def writeKey(filename, key):
+    with open(filename + '.key', 'w') as keyfile:
+        keyfile.write(key)
+
+
+# Is filename the output of a stage run with this key
+def cached(filename, key):
+    return os.path.exists(filename) and readKey(filename) == key
+
+
+def detectParams():
+    return {'max_area': detect.max_area, 'min_area': detect.min_area,
+            'kernel': detect.kernel.shape, 'detector': detect.detector,
+            'centroid': detect.centroid, 'auto': detect.auto,
+            'warmup': detect.warmup, 'max_blobs': detect.max_blobs,
+            'skip_idle': detect.skip_idle}
+
+
+def kalmanParams():
+    return {'init_dist': kalman.init_dist, 'denom': kalman.denom,
+            'min_v_dist': kalman.min_v_dist, 'Sensor_Cov': kalman.Sensor_Cov,
+            'PN_Cov': kalman.PN_Cov,
+            'horizontal_acc_const': kalman.horizontal_acc_const,
+            'max_misses': kalman.max_misses, 'min_length': kalman.min_length,
+            'dedupe': kalman.dedupe}
+
+
+# detect -> kalman -> trajectories -> interpolate for one camera's video,
+# writing the interpolated trajectory to trajectory<n>.npy. With the cache
+# on, each stage whose checkpoint was made from the same inputs and
+# parameters is loaded instead of run again.
+def camera(video, p_clip, n, view='suppress', checkpoint=True, cache=True,
+           status=report, profile=None):
+    if profile is None:
+        profile = profiling.Profile()
+
+    detections_file = stageFile(p_clip, 'detections', n)
+    trajectories_file = stageFile(p_clip, 'trajectories', n)
+    trajectory_file = stageFile(p_clip, 'trajectory', n)
+
+    detections_key = stageKey('detect', detectParams(),
+                              sourceKey('detect.py', 'frames.py',
+                                        'activity.py'),
+                              videoKey(video))
+    trajectories_key = stageKey('kalman', kalmanParams(),
+                                sourceKey('kalman.py'), detections_key)
+    trajectory_key = stageKey('interpolate', {'frame_rate': frame_rate},
+                              sourceKey('trajectories.py', 'interpolate.py'),
+                              trajectories_key)
+
+    if cache and cached(trajectory_file, trajectory_key):
+        with profile.stage('interpolate', camera=n) as s:
+            s['cached'] = True
+        return
+
+    with profile.stage('detect', camera=n) as s:
+        if cache and cached(detections_file, detections_key):
+            detections = records.load(detections_file, records.DETECTION)
+            s['cached'] = True
+        elif view == 'view':
+            # the interactive detector with its display and mode keys
+            status('Detecting...')
+            if not runStage(detections_file, 'detect.py', video,
+                            detections_file, view):
+                raise RuntimeError('detect.py stopped without writing ' +
+                                   detections_file)
+            detections = records.load(detections_file, records.DETECTION)
+            writeKey(detections_file, detections_key)
+        else:
+            status('Detecting...')
+            detections = records.pack(detect.detectClip(video, stats=s),
+                                      records.DETECTION)
+            if checkpoint:
+                records.save(detections_file, detections)
+                writeKey(detections_file, detections_key)
+
+        s['detections'] = len(detections)
+
+    with profile.stage('kalman', camera=n) as s:
+        if cache and cached(trajectories_file, trajectories_key):
+            candidates = records.load(trajectories_file, records.TRAJECTORY)
+            s['cached'] = True
+        else:
+            status('Generating trajectories...')
+            candidates = records.pack(kalman.segment(detections),
+                                      records.TRAJECTORY)
+            if checkpoint:
+                records.save(trajectories_file, candidates)
+                writeKey(trajectories_file, trajectories_key)
+
+        s['trajectories'] = len(set(candidates['tid'].tolist()))
+
+    with profile.stage('select', camera=n) as s:
+        status('Selecting the best trajectory...')
+        trajectory, fig = trajectories.select(candidates, detections)
+        if view == 'view':
+            plt.show()
+        plt.close(fig)
+        s['points'] = len(trajectory)
+
+    with profile.stage('interpolate', camera=n) as s:
+        status('Interpolating...')
+        interpolate.view = view == 'view'
+        points = interpolate.interpolateTrajectory(trajectory, frame_rate)
+        interpolate.writeInterpolated(points, trajectory_file)
+        writeKey(trajectory_file, trajectory_key)
+        s['points'] = len(points)
+
+
+# Pool worker: one camera's branch, headless. Returns the stages it ran for
+# the profile.
+def cameraJob(job):
+    video, p_clip, n, checkpoint, cache = job
+    plt.switch_backend('Agg')
+    profile = profiling.Profile()
+    camera(video, p_clip, n, 'suppress', checkpoint, cache, profile=profile)
+    return profile.stages
+
+
+# Pool worker: one of the stage scripts, which mustn't show anything
+def scriptJob(job):
+    plt.switch_backend('Agg')
+    return runScript(*job)
+
+
+# Run a job per camera in its own process, returning once they've all ended
+def runParallel(worker, jobs):
+    pool = multiprocessing.Pool(len(jobs))
+    try:
+        return pool.map(worker, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# Make the tracer videos, each a trace.py job. Headless they're made in pool
+# workers, viewed they're shown one after the other from this process.
+# Returns whether they were all made.
+def traceVideos(jobs, view):
+    if view == 'suppress':
+        made = runParallel(scriptJob, [job + ('suppress',) for job in jobs])
+    else:
+        made = [runScript(*job) for job in jobs]
+    return all(made)
+
+
+# Create the clip and reconstruction data, only running the stages whose
+# inputs or parameters have changed unless the cache is off. The cameras run
+# concurrently unless parallel is off (eg. already inside a pool worker).
+def analyse(session, clip, vid1, vid2, view='suppress', checkpoint=True,
+            parallel=True, cache=True, status=report, profile=None):
+    if profile is None:
+        profile = profiling.Profile()
+
+    p_session = sessionPath(session)
+    p_clip = clipPath(session, clip)
+    if not os.path.exists(p_clip):
+        os.makedirs(p_clip)
+
+    # viewing the stages needs this process's windows, one camera at a time
+    if view == 'view' or not parallel:
+        camera(vid1, p_clip, 1, view, checkpoint, cache, status, profile)
+        camera(vid2, p_clip, 2, view, checkpoint, cache, status, profile)
+    else:
+        status('Detecting and tracking in both cameras...')
+        for stages in runParallel(cameraJob,
+                                  [(vid1, p_clip, 1, checkpoint, cache),
+                                   (vid2, p_clip, 2, checkpoint, cache)]):
+            profile.extend(stages)
+
+    # reconstruct's settings live in its source
+    scene = fileKey(*[os.path.join(p_session, f) for f in scene_files])
+    out3d = os.path.join(p_clip, '3d_out.npy')
+    key = stageKey('reconstruct', {},
+                   sourceKey('reconstruct.py'), scene,
+                   readKey(stageFile(p_clip, 'trajectory', 1)),
+                   readKey(stageFile(p_clip, 'trajectory', 2)))
+
+    with profile.stage('reconstruct') as s:
+        if cache and cached(out3d, key):
+            s['cached'] = True
+        else:
+            status('Reconstructing...')
+            if runStage(out3d, 'reconstruct.py', session, clip, view):
+                writeKey(out3d, key)
+            else:
+                status('Could not reconstruct ' + clip +
+                       ', see reconstruct.py\'s output')
+
+        if os.path.exists(out3d):
+            s['points'] = len(records.load(out3d, records.POINT3D))
+
+
+# Save the top down and side on views of the clip's 3D trajectory. Returns
+# the names of any that failed.
+def saveViews(session, clip, cache=True, status=report, profile=None):
+    if profile is None:
+        profile = profiling.Profile()
+
+    p_clip = clipPath(session, clip)
+    graphs = os.path.join(p_clip, 'graphs')
+    if not os.path.isdir(graphs):
+        os.makedirs(graphs)
+
+    # older clips may only have the text versions of the stage files
+    out3d = records.path(os.path.join(p_clip, '3d_out'))
+
+    status('Generating and saving views...')
+    failed = []
+    for script, pdf in [('top_down.py', 'top_down.pdf'),
+                        ('side_on.py', 'side_on.pdf')]:
+        pdf = os.path.join(graphs, pdf)
+        key = stageKey(script, {}, sourceKey(script), readKey(out3d))
+        with profile.stage(os.path.splitext(script)[0]) as s:
+            if cache and cached(pdf, key):
+                s['cached'] = True
+            elif attempt(status, script, runStage, pdf, script, out3d,
+                         pdf):
+                writeKey(pdf, key)
+            else:
+                failed.append(script)
+
+    return failed
+
+
+# Everything's there: Visualise it. Tracer videos only if the clips are given.
+# A view that fails is reported and the rest are still made. The tracer
+# videos are only shown as they're made with view on.
+def visualise(session, clip, vid1=None, vid2=None, status=report,
+              profile=None, view='suppress'):
+    if profile is None:
+        profile = profiling.Profile()
+
+    p_session = sessionPath(session)
+    p_clip = clipPath(session, clip)
+    graphs = os.path.join(p_clip, 'graphs')
+    if not os.path.isdir(graphs):
+        os.makedirs(graphs)
+
+    failed = []
+    if vid1 and vid2:
+        status('Generating and saving tracer videos...')
+        with profile.stage('trace'):
+            if not attempt(status, 'trace.py', traceVideos, [
+                    ('trace.py', vid1,
+                     records.path(os.path.join(p_clip, 'trajectory1')),
+                     os.path.join(graphs, 'trace1.mov')),
+                    ('trace.py', vid2,
+                     records.path(os.path.join(p_clip, 'trajectory2')),
+                     os.path.join(graphs, 'trace2.mov'))], view):
+                failed.append('trace.py')
+
+    failed.extend(saveViews(session, clip, status=status, profile=profile))
+    with profile.stage('beehive'):
+        if not attempt(status, 'beehive.py', runScript, 'beehive.py',
+                       p_session, os.path.join(p_session, 'beehive.png')):
+            failed.append('beehive.py')
+    with profile.stage('generate_x3d'):
+        if not attempt(status, 'generate_x3d.py', runScript,
+                       'generate_x3d.py', p_clip):
+            failed.append('generate_x3d.py')
+
+    if len(failed) != 0:
+        status('Done, except for ' + ', '.join(failed))
+    else:
+        status("Done!")
+
+
+# The scene data for a new session, whatever has changed in the clip, then
+# the views. The clip's profile is written to its stats/profile.json.
+def run(session, clip, vid1, vid2, cal1=None, cal2=None, view='suppress',
+        checkpoint=True, status=report):
+    profile = profiling.Profile()
+
+    if not os.path.exists(sessionPath(session)):
+        scene(session, cal1, cal2, vid1, vid2, view, status, profile)
+
+    analyse(session, clip, vid1, vid2, view, checkpoint, status=status,
+            profile=profile)
+
+    visualise(session, clip, vid1, vid2, status, profile, view)
+
+    status('Profile written to ' +
+           profile.save(clipPath(session, clip)))
+
+
+def main():
+    if len(sys.argv) < 5:
+        print "Usage : ./pipeline.py <session> <clip> <video1> <video2>" + \
+            " *<calibration1> <calibration2>*"
+        sys.exit(0)
+
+    session, clip, vid1, vid2 = sys.argv[1:5]
+    try:
+        cal1, cal2 = sys.argv[5:7]
+    except ValueError:
+        cal1 = cal2 = None
+
+    if not os.path.exists(sessionPath(session)) and cal1 is None:
+        print "WARN: a new session needs both calibration videos"
+        sys.exit(0)
+
+    run(session, clip, vid1, vid2, cal1, cal2)
+
+
+if __name__ == '__main__':
+    main()
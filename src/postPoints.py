@@ -12,7 +12,7 @@ points are saved to file, and the relevant frame is saved too.
 import cv2
 import cv2.cv as cv
 import sys
-import os
+from frames import FrameSource
 
 
 # mouse callback function
@@ -47,14 +47,11 @@ infilename = sys.argv[1]
 outfilename = sys.argv[2]
 image_outfile = sys.argv[3]
 
-# supplied path can be a directory containing an image sequence: 00001.png
-if os.path.isdir(infilename):
-    infilename = infilename + '/frame_%05d.png'
-
 outfile = open(outfilename, 'w')
 counter = 0
 
-cap = cv2.VideoCapture(infilename)
+# supplied path can also be a directory containing an image sequence
+cap = FrameSource(infilename, count=1)
 
 ret, original = cap.read()
 
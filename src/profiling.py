@@ -0,0 +1,171 @@
+#!/usr/local/bin/python
+
+''' profiling.py
+
+Lightweight instrumentation of the pipeline's stages.
+
+A Profile records each stage as it runs: its wall clock time, the CPU time
+of the process that ran it and of the worker processes it waited for, its
+memory, and whatever the stage counted (frames fed to the detector,
+detections, trajectories, points). Stages loaded from the stage cache are
+recorded as cached.
+
+The operating system only keeps the peak resident memory of a process over
+its whole life, so a stage's cumulative_peak_rss_mb is the peak of the
+process so far, carried over from earlier stages and, in a batch worker,
+earlier clips. peak_rss_growth_mb is how far the stage raised it, 0 for a
+stage that fitted under the peak already reached. child_peak_rss_mb is the
+peak of the largest worker process waited for so far.
+
+pipeline.py keeps a profile of each clip it analyses, and it's written to
+the clip's stats/profile.json next to reconstruct.py's all_stats.txt. Run on
+a session, this script adds up its clips' profiles to show where the time
+goes across the session.
+
+arg1 = session directory, eg. sessions/coombe
+
+'''
+
+import sys
+import os
+import glob
+import json
+import time
+import resource
+import contextlib
+
+# ru_maxrss is in kilobytes, but bytes on a Mac
+rss_unit = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+
+
+# Peak resident memory so far in MB, of this process or, with
+# RUSAGE_CHILDREN, of the largest child process waited for
+def peakRSS(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / rss_unit
+
+
+# CPU time used so far in seconds, by this process or, with RUSAGE_CHILDREN,
+# by the child processes waited for
+def cpuTime(who=resource.RUSAGE_SELF):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+# The stages of one clip's analysis, in the order they started
+class Profile(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = []
+
+    # Time the stage run inside a with block. The record it gives is the
+    # stage's entry in the profile, the stage adds its counts to it:
+    #
+    #   with profile.stage('detect', camera=1) as s:
+    #       ...
+    #       s['detections'] = len(detections)
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        record = dict(fields, stage=name, cached=False)
+        self.stages.append(record)
+
+        wall = time.time()
+        cpu = cpuTime()
+        child_cpu = cpuTime(resource.RUSAGE_CHILDREN)
+        rss = peakRSS()
+        try:
+            yield record
+        finally:
+            record['secs'] = time.time() - wall
+            record['cpu_secs'] = cpuTime() - cpu
+            record['child_cpu_secs'] = \
+                cpuTime(resource.RUSAGE_CHILDREN) - child_cpu
+            record['cumulative_peak_rss_mb'] = peakRSS()
+            record['peak_rss_growth_mb'] = peakRSS() - rss
+            record['child_peak_rss_mb'] = peakRSS(resource.RUSAGE_CHILDREN)
+
+    # add the stages recorded by another process
+    def extend(self, stages):
+        self.stages.extend(stages)
+
+    # Write the profile to the clip's stats/profile.json
+    def save(self, p_clip):
+        stats = os.path.join(p_clip, 'stats')
+        if not os.path.isdir(stats):
+            os.makedirs(stats)
+
+        filename = os.path.join(stats, 'profile.json')
+        rss = [max(s['cumulative_peak_rss_mb'], s['child_peak_rss_mb'])
+               for s in self.stages if 'cumulative_peak_rss_mb' in s]
+        profile = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'secs': time.time() - self.start,
+                   'cumulative_peak_rss_mb': max(rss + [peakRSS()]),
+                   'stages': self.stages}
+
+        with open(filename, 'w') as outfile:
+            json.dump(profile, outfile, indent=2, sort_keys=True)
+        return filename
+
+
+# The saved profiles of every clip in a session
+def load(p_session):
+    profiles = []
+    for filename in sorted(glob.glob(os.path.join(p_session, '*', 'stats',
+                                                  'profile.json'))):
+        with open(filename) as infile:
+            profiles.append(json.load(infile))
+    return profiles
+
+
+def main():
+    try:
+        p_session = sys.argv[1]
+    except IndexError:
+        print "Usage: ./profiling.py <session directory>"
+        sys.exit()
+
+    profiles = load(p_session)
+    print "> Clips:", len(profiles)
+    if len(profiles) == 0:
+        return
+
+    # stage: [runs, cached runs, seconds, cpu seconds of the process and its
+    # workers, largest growth of the peak RSS]. Profiles saved before the
+    # workers and growth were recorded count them as 0.
+    totals = {}
+    order = []
+    for profile in profiles:
+        for s in profile['stages']:
+            if s['stage'] not in totals:
+                totals[s['stage']] = [0, 0, 0.0, 0.0, 0.0]
+                order.append(s['stage'])
+
+            t = totals[s['stage']]
+            t[0] += 1
+            t[1] += s['cached']
+            t[2] += s['secs']
+            t[3] += s['cpu_secs'] + s.get('child_cpu_secs', 0)
+            t[4] = max(t[4], s.get('peak_rss_growth_mb', 0))
+
+    total = sum(t[2] for t in totals.values())
+
+    print
+    print "%-14s %6s %7s %10s %7s %10s %10s" % \
+        ('stage', 'runs', 'cached', 'secs', 'share', 'cpu secs', '+peak MB')
+    for name in order:
+        runs, cached, secs, cpu, rss = totals[name]
+        print "%-14s %6d %7d %10.1f %6.1f%% %10.1f %10.1f" % \
+            (name, runs, cached, secs, 100.0 * secs / total if total else 0,
+             cpu, rss)
+    print "(cpu secs include the stage's workers, +peak MB is the most a run"
+    print " of the stage raised its process's peak memory)"
+
+    print
+    print "> Clip time: %.1fs" % sum(p['secs'] for p in profiles)
+    print "> Peak memory: %.1fMB" % \
+        max(p.get('cumulative_peak_rss_mb', p.get('peak_rss_mb', 0))
+            for p in profiles)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@
     create artificial image data of a 3d model, and save that image data
     to the same directory as the model resides in.
 
+    project() can be imported to project other 3d points, set verbose off
+    to keep it quiet.
+
 '''
 
 
@@ -22,6 +25,9 @@ import plotting as plot
 
 np.set_printoptions(suppress=True)
 
+# print the matrices of each projection
+verbose = True
+
 
 def main():
 
@@ -96,8 +102,8 @@ def main():
         noise = sys.argv[2]
         img_pts1 = addNoise(float(noise), img_pts1)
         img_pts2 = addNoise(float(noise), img_pts2)
-    except indexError:
-        continue
+    except IndexError:
+        pass
 
     writeData(folder, img_pts1, img_pts2)
 
@@ -106,23 +112,23 @@ def main():
 # given intrinsic, rotation matrix and translation vector
 def project(objectPoints, K, R, t):
 
-    print "--------- MANUAL PROJECTION -----------"
     objectPoints = cv2.convertPointsToHomogeneous(objectPoints)
     objectPoints = fixExtraneousParentheses(objectPoints)
 
     imagePoints = []
-    print "K:\n", K
 
     t = np.mat(t)
     t = t.T
-    print "R:\n", R
-    print "t:\n", t
-
     Rt = np.concatenate((R, t), 1)
-    print "R|t:\n", Rt
-
     P = K * Rt
-    print "P = k(R|t):\n", P
+
+    if verbose:
+        print "--------- MANUAL PROJECTION -----------"
+        print "K:\n", K
+        print "R:\n", R
+        print "t:\n", t
+        print "R|t:\n", Rt
+        print "P = k(R|t):\n", P
 
     for X in objectPoints:
         x = np.mat(X).T
@@ -250,4 +256,5 @@ def addNoise(sigma, points):
     return np.array(new, dtype='float32')
 
 
-main()
+if __name__ == '__main__':
+    main()
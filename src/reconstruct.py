@@ -17,11 +17,11 @@
         postPts2.txt
 
     Clip folder should contain:
-        trajectory1.txt
-        trajectory2.txt
+        trajectory1.npy / .txt
+        trajectory2.npy / .txt
 
     OUTPUT:
-        - 3d_out.txt into <clip_folder>
+        - 3d_out.npy into <clip_folder> (./records.py exports it as text)
         - /stats/ in <clip_folder> containing accuracy of reconstruction etc.
 
     KEY METHODS CONTAINED:
@@ -58,6 +58,7 @@ import matplotlib.pyplot as plt
 from collections import namedtuple
 from mpl_toolkits.mplot3d import Axes3D
 import os.path
+import records
 import numpy.random as random
 import fundamental as fund
 import triangulation as tri
@@ -177,14 +178,10 @@ def run():
             reconstructionError(data3D, scaled_gp)
 
         # write X Y Z to file
-        outfile = open('sessions/' + clip + '/3d_out.txt', 'w')
-        for p in scaled_gp:
-            p0 = round(p[0], 2)
-            p1 = round(p[1], 2)
-            p2 = round(p[2], 2)
-            string = str(p0) + ' ' + str(p1) + ' ' + str(p2)
-            outfile.write(string + '\n')
-        outfile.close()
+        rows = [(round(p[0], 2), round(p[1], 2), round(p[2], 2))
+                for p in scaled_gp]
+        records.save('sessions/' + clip + '/3d_out.npy',
+                     records.pack(rows, records.POINT3D))
 
 
 def synchroniseAtApex(pts_1, pts_2):
@@ -362,29 +359,11 @@ def getData(session, clip):
 
     # Get the trajectory correspondences for the clip
     try:
-        with open(clip + 'trajectory1.txt') as datafile:
-            data = datafile.read()
-            datafile.close()
-
-        data = data.split('\n')
-        if data[-1] in ['\n', '\r\n', '']:
-            data.pop(-1)
-        for row in data:
-            x = float(row.split()[0])
-            y = float(row.split()[1])
-            pts3.append([x, y])
+        data = records.load(records.path(clip + 'trajectory1'), records.POINT)
+        pts3 = [[x, y] for x, y in zip(data['x'].tolist(), data['y'].tolist())]
 
-        with open(clip + 'trajectory2.txt') as datafile:
-            data = datafile.read()
-            datafile.close()
-
-        data = data.split('\n')
-        if data[-1] in ['\n', '\r\n', '']:
-            data.pop(-1)
-        for row in data:
-            x = float(row.split()[0])
-            y = float(row.split()[1])
-            pts4.append([x, y])
+        data = records.load(records.path(clip + 'trajectory2'), records.POINT)
+        pts4 = [[x, y] for x, y in zip(data['x'].tolist(), data['y'].tolist())]
 
         rec_data = True
         print "> Designated trajectory correspondences provided."
@@ -0,0 +1,109 @@
+#!/usr/local/bin/python
+
+''' records.py
+
+Typed interchange format for the point data passed between pipeline stages.
+
+Each stage hands its points on as a structured numpy array saved to a .npy
+file, which the next stage maps straight into memory without parsing.
+Any other extension is read and written as the original whitespace
+separated text, so older sessions and hand-made data files still work and
+text is only produced when a .txt name is asked for.
+
+Record types, field order matches the text columns:
+
+    DETECTION   x y frame pid       detect.py, interpolate.py
+    TRAJECTORY  tid x y frame pid   kalman.py
+    POINT       x y frame           trajectories.py
+    POINT3D     x y z               reconstruct.py (3d_out)
+
+*arg1* = .npy file to export as text
+*arg2* = optional text outfile, otherwise the same name with .txt
+
+'''
+
+import sys
+import os.path
+import numpy as np
+
+DETECTION = np.dtype([('x', float), ('y', float),
+                      ('frame', int), ('pid', int)])
+
+TRAJECTORY = np.dtype([('tid', int), ('x', float), ('y', float),
+                       ('frame', int), ('pid', int)])
+
+POINT = np.dtype([('x', float), ('y', float), ('frame', int)])
+
+POINT3D = np.dtype([('x', float), ('y', float), ('z', float)])
+
+
+# is the file in the binary record format
+def binary(filename):
+    return os.path.splitext(filename)[1] == '.npy'
+
+
+# the binary version of a stage's file if it exists, otherwise the text one
+def path(stem):
+    if os.path.exists(stem + '.npy'):
+        return stem + '.npy'
+    return stem + '.txt'
+
+
+# build an array of records from a sequence of tuples
+def pack(rows, dtype):
+    return np.array([tuple(row) for row in rows], dtype=dtype)
+
+
+# Load a file of records: .npy files are memory mapped, anything else is
+# parsed as text with one record per row. Extra text columns are ignored.
+def load(filename, dtype):
+    if binary(filename):
+        return np.load(filename, mmap_mode='r')
+
+    with open(filename) as datafile:
+        data = datafile.read()
+        datafile.close()
+
+    records = np.zeros(0, dtype=dtype)
+    first = data.split('\n', 1)[0].split()
+    if len(first) == 0:
+        return records
+
+    columns = np.fromstring(data, sep=' ').reshape(-1, len(first))
+    records = np.zeros(len(columns), dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        records[name] = columns[:, i]
+    return records
+
+
+# Save records as .npy, or as text if any other extension is given. The .npy
+# only appears once it's complete, so a stage interrupted part way through
+# never leaves a file that looks finished.
+def save(filename, records):
+    if binary(filename):
+        partial = filename + '.part'
+        with open(partial, 'wb') as outfile:
+            np.save(outfile, records)
+        os.rename(partial, filename)
+        return
+
+    outfile = open(filename, 'w')
+    for row in records.tolist():
+        outfile.write(' '.join(repr(v) for v in row) + '\n')
+    outfile.close()
+
+
+def main():
+    infilename = sys.argv[1]
+    try:
+        outfilename = sys.argv[2]
+    except IndexError:
+        outfilename = os.path.splitext(infilename)[0] + '.txt'
+
+    records = np.load(infilename)
+    save(outfilename, records)
+    print "> Exported", len(records), "records to:", outfilename
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,13 @@
     y-z plane, with straight line between start and end and a virtual
     wall superimposed at 10 yards.
 
-    arg1 = infile
+    arg1 = infile (.npy from reconstruct.py, or text)
     arg2 = optional outfile
 '''
 
 import sys
 import matplotlib.pyplot as plt
+import records
 
 infilename = sys.argv[1]
 outfilename = None
@@ -20,19 +21,11 @@ try:
 except IndexError:
     pass
 
-with open(infilename) as datafile:
-    data = datafile.read()
-    datafile.close()
+data = records.load(infilename, records.POINT3D)
 
-data = data.split('\n')
-
-# get rid of any empty line at the end of file
-if data[-1] in ['\n', '\r\n', '']:
-    data.pop(-1)
-
-x = [row.split()[0] for row in data]
-y = [row.split()[1] for row in data]
-z = [row.split()[2] for row in data]
+x = data['x'].tolist()
+y = data['y'].tolist()
+z = data['z'].tolist()
 
 # Get goalpost corner points
 bly = y.pop(0)
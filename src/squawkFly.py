@@ -6,8 +6,8 @@
 The all-encompassing GUI and controller for user operation.
 
 Requires no command line arguments, just boots the graphical interface and
-proceeds to call the requisite scripts based on the file paths supplied through
-that, and manage the underlying filesystem.
+proceeds to run the pipeline (pipeline.py) in process on the file paths
+supplied through that, and manage the underlying filesystem.
 
 Built with Python's Tkinter and ttk framework.
 
@@ -20,6 +20,8 @@ from tkFileDialog import askdirectory
 import os
 import shutil
 import subprocess
+import pipeline
+import profiling
 
 
 # Set the status message
@@ -28,18 +30,6 @@ def setStatus(string):
     status_label.update()
 
 
-# escape any spaces that might appear in the input paths
-def handleSpaces(string):
-    i = string.find(' ')
-    new = string[:i] + '\\' + string[i:]
-
-    i = new.find(' ')
-    if new.find('\ ') != i - 1:
-        new = handleSpaces(new)
-
-    return new
-
-
 '''
     All of the choose methods assign a path to a text variable to later
     be passed as command line arguments to the system scripts.
@@ -119,7 +109,6 @@ def submit(*args):
     print "--Submit--"
 
     new_session = False
-    new_clip = False
     videos = False
     session = session_name.get()
     clip = clip_name.get()
@@ -145,122 +134,33 @@ def submit(*args):
             return
 
     if not os.path.exists(p_clip):
-        new_clip = True
         if not vid1 or not vid2:
             print "WARN: Invalid input. To create a new clip in an" + \
                 "existing session you must submit both free kick videos."
             return
 
-    if new_session:
-        cal1 = handleSpaces(calib1.get())
-        cal2 = handleSpaces(calib2.get())
-
-    # technically, user could supply these for the visualisation of an old clip
-    if videos:
-        vid1 = handleSpaces(clip1.get())
-        vid2 = handleSpaces(clip2.get())
-
-    # paths
-    p_session = "sessions/" + session
-    p_clip = p_session + '/' + clip
-
     print "Session:", p_session
     print "Clip:", p_clip
 
-    session = ' ' + p_session + '/'
-    clip = ' ' + p_clip + '/'
-
-    # Setup all of the various arguments to be passed to each step
-    # of the processing pipeline
-    args_cal1 = cal1 + session + 'camera1.txt ' + view
-    args_cal2 = cal2 + session + 'camera2.txt ' + view
-
-    args_posts1 = vid1 + session + 'postPts1.txt' + session + 'image1.png'
-    args_posts2 = vid2 + session + 'postPts2.txt' + session + 'image2.png'
-
-    args_match = vid1 + ' ' + vid2 + session + \
-        'statics1.txt' + session + 'statics2.txt'
-
-    args_detect1 = vid1 + clip + 'detections1.txt ' + view
-    args_detect2 = vid2 + clip + 'detections2.txt ' + view
-
-    args_kalman1 = clip + "detections1.txt" + clip + "trajectories1.txt"
-    args_kalman2 = clip + "detections2.txt" + clip + "trajectories2.txt"
-
-    args_traj1 = clip + "detections1.txt" + clip + \
-        "trajectories1.txt" + clip + "trajectory1.txt " + view
-    args_traj2 = clip + "detections2.txt" + clip + \
-        "trajectories2.txt" + clip + "trajectory2.txt " + view
-
-    args_interp1 = clip + 'trajectory1.txt 30' + \
-        clip + 'trajectory1.txt ' + view
-    args_interp2 = clip + 'trajectory2.txt 30' + \
-        clip + 'trajectory2.txt ' + view
-
-    args_reconstruct = session_name.get() + ' ' + clip_name.get() + ' ' + view
-
-    args_topdown = clip + '3d_out.txt ' + clip + 'graphs/top_down.pdf'
-    args_sideon = clip + '3d_out.txt ' + clip + 'graphs/side_on.pdf'
-
-    args_trace1 = vid1 + ' ' + clip + \
-        'trajectory1.txt ' + clip + 'graphs/trace1.mov'
-    args_trace2 = vid2 + ' ' + clip + \
-        'trajectory2.txt ' + clip + 'graphs/trace2.mov'
-
-    args_beehive = p_session + ' ' + os.path.join(p_session, 'beehive.png')
+    # each stage's time and memory, written to the clip's stats
+    profile = profiling.Profile()
 
     # New session: create the scene data
-    if not os.path.exists(p_session):
-        os.makedirs(p_session)
-
-        setStatus('Calibrating...')
-        os.system("./calibrate.py " + args_cal1)
-        os.system("./calibrate.py " + args_cal2)
-
-        setStatus('Matching goalposts...')
-        os.system("./postPoints.py " + args_posts1)
-        os.system("./postPoints.py " + args_posts2)
-
-        setStatus('Matching scene points...')
-        os.system("./manualMatch.py " + args_match)
-
-    # New clip: create the clip and reconstruction data
-    if not os.path.exists(p_clip):
-        os.makedirs(p_clip)
-        setStatus('Detecting...')
-        os.system("./detect.py " + args_detect1)
-        os.system("./detect.py " + args_detect2)
-
-        setStatus('Generating trajectories...')
-        os.system("./kalman.py" + args_kalman1)
-        os.system("./kalman.py" + args_kalman2)
-
-        setStatus('Selecting the best trajectory...')
-        os.system("./trajectories.py -1" + args_traj1)
-        os.system("./trajectories.py -1" + args_traj2)
-
-        setStatus('Interpolating...')
-        os.system("./interpolate.py" + args_interp1)
-        os.system("./interpolate.py" + args_interp2)
-
-        setStatus('Reconstructing...')
-        os.system("./reconstruct.py " + args_reconstruct)
+    if new_session:
+        pipeline.scene(session, cal1, cal2, vid1, vid2, view, setStatus,
+                       profile)
 
-    # Clip never analysed before: Create the graphs directory
-    if not os.path.isdir(p_clip + '/graphs'):
-        os.makedirs(p_clip + '/graphs')
+    # New clip, or new settings: the stage cache only re-runs the stages
+    # whose inputs or parameters have changed
+    if videos:
+        pipeline.analyse(session, clip, vid1, vid2, view, status=setStatus,
+                         profile=profile)
 
     # Everything's there: Visualise it
-    if videos:
-        setStatus('Generating and saving tracer videos...')
-        os.system("./trace.py " + args_trace1)
-        os.system("./trace.py " + args_trace2)
-    setStatus('Generating and saving views...')
-    os.system("./top_down.py " + args_topdown)
-    os.system("./side_on.py " + args_sideon)
-    os.system("./beehive.py " + args_beehive)
-    os.system("./generate_x3d.py " + p_clip)
-    setStatus("Done!")
+    if not videos:
+        vid1 = vid2 = None
+    pipeline.visualise(session, clip, vid1, vid2, setStatus, profile, view)
+    print "> Profile written to:", profile.save(p_clip)
 
     # finish by revealing the results in finder
     subprocess.call(["open", "-R", p_clip + '/graphs'])
@@ -6,13 +6,14 @@
     x-z plane, with straight line between start and end and the maximum
     lateral displacement from that line measured.
 
-    arg1 = infile
+    arg1 = infile (.npy from reconstruct.py, or text)
     arg2 = optional outfile
 '''
 
 import sys
 import math
 import matplotlib.pyplot as plt
+import records
 
 left = 'left'
 right = 'right'
@@ -58,19 +59,11 @@ try:
 except IndexError:
     pass
 
-with open(infilename) as datafile:
-    data = datafile.read()
-    datafile.close()
+data = records.load(infilename, records.POINT3D)
 
-data = data.split('\n')
-
-# get rid of any empty line at the end of file
-if data[-1] in ['\n', '\r\n', '']:
-    data.pop(-1)
-
-x = [row.split()[0] for row in data]
-y = [row.split()[1] for row in data]
-z = [row.split()[2] for row in data]
+x = data['x'].tolist()
+y = data['y'].tolist()
+z = data['z'].tolist()
 
 # goalpost corners
 blx = x[0]
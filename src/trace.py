@@ -6,8 +6,9 @@
     the final speed and distance to goal extracted from the 3D model.
 
     arg1 = video clip or image sequence (clip.mp4 or /clip/)
-    arg2 = 2d trajectory corresponding to that clip (trajectory.txt)
+    arg2 = 2d trajectory corresponding to that clip (trajectory.npy / .txt)
     arg3 = optional outfilename for saving the video to
+    arg4 = optional 'suppress' to only save the video, without showing it
 
     Finds speed and distance in 'tracer_stats.txt' inside the same
     directory as the trajectory resides in.
@@ -21,19 +22,29 @@ import numpy as np
 import os.path
 from time import sleep
 import plotting as plot
+import records
+import frames
 
 if len(sys.argv) < 3:
-    print "Usage : python trace.py <image_sequence> <trajectory> <outfile>"
+    print "Usage : python trace.py <image_sequence> <trajectory> <outfile>" + \
+        " *<view>*"
     sys.exit(0)
 
 clip = sys.argv[1]
 trajectory = sys.argv[2]
 
+outfilename = None
 try:
     outfilename = sys.argv[3]
 except:
     pass
 
+show = True
+try:
+    show = sys.argv[4] != 'suppress'
+except IndexError:
+    pass
+
 t_dir = os.path.dirname(trajectory)
 tracer_stats = t_dir + '/tracer_stats.txt'
 
@@ -44,9 +55,7 @@ else:
     print "> Input Type: Video File"
 
 # Get trajectory data
-with open(trajectory) as datafile:
-    data = datafile.read()
-    datafile.close()
+data = records.load(trajectory, records.POINT)
 
 with open(tracer_stats) as datafile:
     stats = datafile.read()
@@ -59,17 +68,11 @@ distance = stats[1]
 avg_speed = 'Average Speed: ' + str(avg_speed) + 'mph'
 distance = 'Distance covered*: ' + str(distance) + 'm'
 
-all_x = []
-all_y = []
-all_f = []
-
-data = data.split('\n')
-for row in data:
-    all_x.append(row.split()[0])
-    all_y.append(row.split()[1])
-    all_f.append(int(row.split()[2]))
+all_x = data['x'].tolist()
+all_y = data['y'].tolist()
+all_f = data['frame'].tolist()
 
-cap = cv2.VideoCapture(clip)
+cap = frames.FrameSource(clip)
 count = 0
 dots = []
 save = False
@@ -121,8 +124,9 @@ while (1):
 
         except ValueError, e:
             pass
-        cv2.imshow('Stream', frame)
-        cv2.waitKey(1)
+        if show:
+            cv2.imshow('Stream', frame)
+            cv2.waitKey(1)
         count += 1
         if save:
             vout.write(frame)
@@ -134,4 +138,5 @@ cap.release()
 if save:
     vout.release()
     vout = None
-cv2.destroyAllWindows()
+if show:
+    cv2.destroyAllWindows()
@@ -17,20 +17,14 @@
     arg3 = optional infile for candidate trajectories
 
     arg4 = optional outfile for subset of trajectories
+
+    any of the files can be .npy, in the binary format of records.py
 '''
 
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
-
-
-# default to showing the detection streams
-view = True
-try:
-    if sys.argv[5] == 'suppress':
-        view = False
-except IndexError:
-    pass
+import records
 
 
 # how long is the trajectory from start to finish across the screen
@@ -58,154 +52,169 @@ def pixLength(set_x, set_y):
     return length
 
 
-min_length = 0
-if len(sys.argv) > 1:
-    min_length = int(sys.argv[1])
-
-try:
-    infile_detections = sys.argv[2]
-except IndexError:
-    infile_detections = 'data/data_detections.txt'
-
-try:
-    infile_trajectories = sys.argv[3]
-except IndexError:
-    infile_trajectories = 'data/data_trajectories.txt'
-
-try:
-    outfilename = sys.argv[4]
-except IndexError:
-    outfilename = 'data_trajectories_subset.txt'
-
-# get the trajectory data
-with open(infile_trajectories) as datafile:
-    trajectories = datafile.read()
-    datafile.close()
-
-# Get the original data points for overlay
-with open(infile_detections) as datafile:
-    raw = datafile.read()
-    datafile.close()
-
-outfile = open(outfilename, 'w')
-
-trajectories = trajectories.split('\n')
-raw = raw.split('\n')
-
-# get rid of any empty line at the end of file
-if raw[-1] in ['\n', '\r\n', '']:
-    raw.pop(-1)
-if trajectories[-1] in ['\n', '\r\n', '']:
-    trajectories.pop(-1)
-
-# RAW / ORIGINAL
-raw_x = [row.split()[0] for row in raw]
-raw_y = [row.split()[1] for row in raw]
-
-dpi = 113
-h = 800 / dpi
-w = 1280 / dpi
-fig = plt.figure(figsize=(w, h))
-
-ax = plt.axes(xlim=(0, 1280), ylim=(-720, 0))
-ax.set_title("Ball Trajectory from Kalman Filter", y=1.03)
-ax.set_xlabel("Graphical X")
-ax.set_ylabel("Graphical Y")
-ax.plot(raw_x, raw_y, 'k.')
-
-# TRAJECTORIES
-last_tid = int(1)
-tid = int(1)
-
-set_x = []
-set_y = []
-set_f = []
-
-longest = 0
-longest_x = []
-longest_y = []
-longest_f = []
-
-longest_tid = 0
-displayed_tids = []
-
-# Rows are: TID, X, Y, FRAME, PID
-for row in trajectories:
-    tid = int(row.split()[0])
-    x = row.split()[1]
-    y = row.split()[2]
-    f = row.split()[3]
-
-    # add the point to the current trajectory
-    if tid == last_tid:
-        set_x.append(x)
-        set_y.append(y)
-        set_f.append(f)
-
-    # we've reached the end of the trajectory (also the  veryfirst point)
+# Select from the candidate trajectories either the longest one (min_length
+# of -1) or all of those at least min_length long, and draw them over the raw
+# detections. Returns the (x, y, frame) points of the subset and the figure.
+def select(trajectories, raw, min_length=-1):
+    # (x, y, frame) rows of the subset
+    subset = []
+
+    # RAW / ORIGINAL
+    raw_x = raw['x']
+    raw_y = raw['y']
+
+    dpi = 113
+    h = 800 / dpi
+    w = 1280 / dpi
+    fig = plt.figure(figsize=(w, h))
+
+    ax = plt.axes(xlim=(0, 1280), ylim=(-720, 0))
+    ax.set_title("Ball Trajectory from Kalman Filter", y=1.03)
+    ax.set_xlabel("Graphical X")
+    ax.set_ylabel("Graphical Y")
+    ax.plot(raw_x, raw_y, 'k.')
+
+    # TRAJECTORIES
+    last_tid = int(1)
+    tid = int(1)
+
+    set_x = []
+    set_y = []
+    set_f = []
+
+    longest = 0
+    longest_x = []
+    longest_y = []
+    longest_f = []
+
+    longest_tid = 0
+    displayed_tids = []
+
+    # Rows are: TID, X, Y, FRAME, PID
+    for tid, x, y, f, pid in trajectories.tolist():
+
+        # add the point to the current trajectory
+        if tid == last_tid:
+            set_x.append(x)
+            set_y.append(y)
+            set_f.append(f)
+
+        # we've reached the end of the trajectory (also the  veryfirst point)
+        else:
+
+            # check to see if the last T was longest (in pix)
+            length = pixLength(set_x, set_y)
+            if length > longest:
+                longest = length
+                longest_x = set_x
+                longest_y = set_y
+                longest_f = set_f
+                longest_tid = last_tid
+
+            # check to see if the last T is above the min selection length
+            if len(set_x) >= min_length and min_length != -1:
+                displayed_tids.append(last_tid)
+                ax.plot(set_x, set_y, linewidth=2)
+
+                # add (x, y, frame) to subset
+                subset.extend(zip(set_x, set_y, set_f))
+
+            # reset and start the new T
+            set_x = []
+            set_y = []
+            set_f = []
+            last_tid = tid
+            set_x.append(x)
+            set_y.append(y)
+            set_f.append(f)
+
+    # file over - handle the remainder T:
+
+    # is it longer than the longest T yet?
+    length = pixLength(set_x, set_y)
+    if length > longest:
+        longest = length
+        longest_x = set_x
+        longest_y = set_y
+        longest_f = set_f
+        longest_tid = tid
+
+    # is it longer than the minimum length? (exluding -1)
+    if len(set_x) >= min_length and min_length != -1:
+        displayed_tids.append(tid)
+        ax.plot(set_x, set_y, linewidth=2)
+
+        # add (x, y, frame) to subset
+        subset.extend(zip(set_x, set_y, set_f))
+
+    # plot the longest T found if option selected
+    if min_length == -1:
+        ax.plot(longest_x, longest_y, linewidth=2)
+        print "Longest trajectory TID:", longest_tid
+        print "Pixel Length:", round(longest, 1), 'pix'
+        print "Detection Length:", len(longest_x)
+
+        # add (x, y, f) to subset
+        subset.extend(zip(longest_x, longest_y, longest_f))
+
     else:
+        print "Showing trajectories:", displayed_tids
+
+    return records.pack(subset, records.POINT), fig
+
+
+# write (x, y, frame) to subset file
+def writeSubset(subset, filename):
+    if records.binary(filename):
+        records.save(filename, subset)
+        return
+
+    outfile = open(filename, 'w')
+    for a, b, c in subset.tolist():
+        outfile.write(repr(a) + ' ' + repr(b) + ' ' + repr(c) + '\n')
+    outfile.close()
+
+
+def main():
+    # default to showing the detection streams
+    view = True
+    try:
+        if sys.argv[5] == 'suppress':
+            view = False
+    except IndexError:
+        pass
+
+    min_length = 0
+    if len(sys.argv) > 1:
+        min_length = int(sys.argv[1])
+
+    try:
+        infile_detections = sys.argv[2]
+    except IndexError:
+        infile_detections = 'data/data_detections.txt'
+
+    try:
+        infile_trajectories = sys.argv[3]
+    except IndexError:
+        infile_trajectories = 'data/data_trajectories.txt'
+
+    try:
+        outfilename = sys.argv[4]
+    except IndexError:
+        outfilename = 'data_trajectories_subset.txt'
+
+    # get the trajectory data
+    trajectories = records.load(infile_trajectories, records.TRAJECTORY)
+
+    # Get the original data points for overlay
+    raw = records.load(infile_detections, records.DETECTION)
+
+    subset, fig = select(trajectories, raw, min_length)
+    writeSubset(subset, outfilename)
+
+    if view:
+        plt.show()
+
 
-        # check to see if the last T was longest (in pix)
-        length = pixLength(set_x, set_y)
-        if length > longest:
-            longest = length
-            longest_x = set_x
-            longest_y = set_y
-            longest_f = set_f
-            longest_tid = last_tid
-
-        # check to see if the last T is above the min selection length
-        if len(set_x) >= min_length and min_length != -1:
-            displayed_tids.append(last_tid)
-            ax.plot(set_x, set_y, linewidth=2)
-
-            # write (x, y, frame) to subset file
-            for a, b, c in zip(set_x, set_y, set_f):
-                outfile.write(a + ' ' + b + ' ' + c + '\n')
-
-        # reset and start the new T
-        set_x = []
-        set_y = []
-        set_f = []
-        last_tid = tid
-        set_x.append(x)
-        set_y.append(y)
-        set_f.append(f)
-
-# file over - handle the remainder T:
-
-# is it longer than the longest T yet?
-length = pixLength(set_x, set_y)
-if length > longest:
-    longest = length
-    longest_x = set_x
-    longest_y = set_y
-    longest_f = set_f
-    longest_tid = tid
-
-# is it longer than the minimum length? (exluding -1)
-if len(set_x) >= min_length and min_length != -1:
-    displayed_tids.append(tid)
-    ax.plot(set_x, set_y, linewidth=2)
-
-    # write (x, y, frame) to subset file
-    for a, b, c in zip(set_x, set_y, set_f):
-        outfile.write(a + ' ' + b + ' ' + c + '\n')
-
-# plot the longest T found if option selected
-if min_length == -1:
-    ax.plot(longest_x, longest_y, linewidth=2)
-    print "Longest trajectory TID:", longest_tid
-    print "Pixel Length:", round(longest, 1), 'pix'
-    print "Detection Length:", len(longest_x)
-
-    # write (x, y, f) to subset file
-    for a, b, c in zip(longest_x, longest_y, longest_f):
-        outfile.write(a + ' ' + b + ' ' + c + '\n')
-
-else:
-    print "Showing trajectories:", displayed_tids
-
-outfile.close()
-if view:
-    plt.show()
+if __name__ == '__main__':
+    main()